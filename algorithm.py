@@ -1,32 +1,183 @@
-import pandas as pd
 import numpy as np
+import pandas as pd
+from scipy import sparse
 from scipy.optimize import linprog
-# import logging
+try:
+    from scipy.optimize import milp, Bounds, LinearConstraint
+except ImportError:  # scipy < 1.9
+    milp = None
+import logging
 import data_import
+import catalog
+import plan_cache
+import metrics
+import variety
 import time
 
+# linprog methods a meal plan can be solved with. The HiGHS methods need scipy >= 1.6.
+# None uses the default method of the installed scipy.
+SOLVER_METHODS = ['interior-point', 'revised simplex', 'simplex', 'highs', 'highs-ds', 'highs-ipm']
+DEFAULT_SOLVER_METHOD = None
+
+FOOD_BOUNDS = (0, 5)  # 0-500g of every food
+MAX_FOOD_COUNT = 13
+WEEKLY_TIME_LIMIT = 15  # seconds per week, enough for a week of catalog.WEEKLY_MAX_FOODS foods
+
+
+class MealPlanError(ValueError):
+    """
+    No meal plan satisfies the limits. violations lists the limits that the
+    presolve found to be out of reach, as dicts of the constraint, its type ('<=',
+    '>=' or '=='), the limit and the min and max the available foods can reach.
+    """
+
+    def __init__(self, message, violations=()):
+        super().__init__(message)
+        self.violations = list(violations)
+
+
+def get_row_range(row, lower, upper, max_count):
+    """
+    The min and max of row @ x for lower <= x <= upper and sum(x) <= max_count:
+    the lower bounds plus the most negative (positive) values filled greedily
+    up to the count left, as in the fractional knapsack.
+    """
+    base = row @ lower
+    room = upper - lower
+    count_left = max_count - lower.sum()
+    if count_left <= 0 or upper.max() <= 0:
+        return base, base  # No food can be added, e.g. when none is available
+    reach = []
+    for sign in [-1, 1]:
+        values = sign * row
+        candidates = np.nonzero((values > 0) & (room > 0))[0]
+        # All but the pinned foods have the full room, so no more candidates than this are needed
+        k = min(len(candidates), int(np.ceil(count_left / upper.max())) + int((lower > 0).sum()))
+        if k > 0:
+            top = candidates[np.argpartition(-values[candidates], k - 1)[:k]]
+            top = top[np.argsort(-values[top], kind='stable')]
+            taken = np.minimum(room[top], np.maximum(count_left - np.cumsum(room[top]) + room[top], 0))
+            reach.append(base + sign * (values[top] @ taken))
+        else:
+            reach.append(base)
+    return reach[0], reach[1]
+
+
+class MealPlanModel():
+    """
+    The food side of the daily LP: the objective and the constraint rows.
+
+    The nutrient rows are taken from the catalog's contiguous float64
+    (nutrient x food) matrix, so building the model costs one copy of the used rows.
+    """
+
+    def __init__(self, df, low_salt=False, use_sparse=False):
+        food_catalog = catalog.as_catalog(df)
+        columns = ['sugar', 'fibre', 'kcal', 'carb_kcal', 'protein_kcal', 'fat_kcal']
+        if low_salt:
+            columns += ['sodium', 'salt']  # (mg)
+        with metrics.timer('matrix_build', rows=len(food_catalog)):
+            matrix = np.vstack([food_catalog.get_nutrient(column) for column in columns])
+
+        self.c = matrix[0]  # Minimize sugar
+        count = np.ones(matrix.shape[1])
+        # count <= MAX_FOOD_COUNT, fibre >= fibre_limit, (sodium <= sodium_limit, salt <= salt_limit)
+        self.A_ub = np.vstack([count, -matrix[1], matrix[6:]])
+        self.ub_names = ['count'] + columns[1:2] + columns[6:]
+        self.ub_signs = np.array([1, -1] + [1] * len(columns[6:]))  # -1 for the >= rows
+        # kcal, carb_kcal, protein_kcal, fat_kcal == limits
+        self.A_eq = matrix[2:6]
+        self.eq_names = columns[2:6]
+        # Content hash of the catalog side, so cached solutions are never reused for another catalog
+        self.version = plan_cache.get_plan_key(matrix, low_salt)
+        if use_sparse:
+            self.A_ub = sparse.csr_matrix(self.A_ub)
+            self.A_eq = sparse.csr_matrix(self.A_eq)
+
+    def check_limits(self, b_ub, b_eq, bounds):
+        """
+        Presolve: compares every limit to the range its nutrient can reach within the
+        food bounds and the food count cap, and returns the limits out of reach.
+        These are necessary conditions only, the limits together can still be infeasible.
+        The LP can not be unbounded, as every food has a finite upper bound.
+        """
+        A_ub = self.A_ub.toarray() if sparse.issparse(self.A_ub) else self.A_ub
+        A_eq = self.A_eq.toarray() if sparse.issparse(self.A_eq) else self.A_eq
+        lower, upper = bounds[:, 0], bounds[:, 1]
+        violations = []
+        for name, sign, row, limit in zip(self.ub_names, self.ub_signs, A_ub, b_ub):
+            if name == 'count':
+                low, high = lower.sum(), upper.sum()
+            else:
+                low, high = get_row_range(row, lower, upper, b_ub[0])
+            if low > limit + 1e-9:
+                low, high, limit = sorted([sign * low, sign * high]) + [sign * limit]
+                violations.append({'constraint': name, 'type': '<=' if sign > 0 else '>=',
+                                   'limit': limit, 'min': low, 'max': high})
+        # The energy not from carbohydrates, protein or fat (fibre, alcohol), as the macronutrient
+        # limits often can not add up to the kcal limit even if each one is within reach
+        other_kcal = A_eq[0] - A_eq[1:].sum(axis=0), b_eq[0] - b_eq[1:].sum()
+        for name, row, limit in zip(self.eq_names + ['other_kcal'], list(A_eq) + [other_kcal[0]],
+                                    list(b_eq) + [other_kcal[1]]):
+            low, high = get_row_range(row, lower, upper, b_ub[0])
+            if not low - 1e-9 <= limit <= high + 1e-9:
+                violations.append({'constraint': name, 'type': '==', 'limit': limit, 'min': low, 'max': high})
+        return violations
+
+    def solve(self, b_ub, b_eq, bounds=FOOD_BOUNDS, method=DEFAULT_SOLVER_METHOD):
+        kwargs = {} if method is None else {'method': method}
+        return linprog(
+            c=self.c,
+            A_ub=self.A_ub,
+            b_ub=b_ub,
+            A_eq=self.A_eq,
+            b_eq=b_eq,
+            bounds=bounds,
+            **kwargs
+        )
+
 
 class DailyMealPlan():
-    def __init__(self, df_meals, limits={}, prev_meal_plan=None, used_meals=None, day='monday'):
+    """
+    One day's meal plan over the whole food catalog.
+
+    The catalog is shared and never modified. Allergies, used meals and the previous
+    day's categories only clear rows of self.available, which become upper bounds
+    of 0 in the LP. This keeps the LP columns identical from day to day.
+    df_meals is a catalog.Catalog, or a DataFrame of the cleaned foods which is converted to one.
+    used_meals is a variety.VarietyTracker of the previous days, which is only read.
+
+    A solved day can be changed with exclude_foods and pin_foods and re-solved with reoptimize.
+    """
+
+    def __init__(self, df_meals, limits={}, prev_meal_plan=None, used_meals=None, day='monday',
+                 method=DEFAULT_SOLVER_METHOD, model=None, cache=plan_cache.default_cache):
         self.daily_meal_plan_calculated = False
-        self.df = df_meals.copy()  # The df of food items
+        self.catalog = catalog.as_catalog(df_meals)  # The food items
         self.day = day
         self.limits = limits
+        self.method = method
+        self.model = model
+        self.cache = cache  # None to always solve
+        self.solution = None
+        self.solve_time = None
+        self.grams = None
+        self.optimal_meal_plan = None
+        self.total_nutrients = None
+        self.available = np.ones(len(self.catalog), dtype=bool)
+        self.swapped_out = np.zeros(len(self.catalog), dtype=bool)  # Foods excluded by exclude_foods
+        self.pinned = {}  # Catalog row -> the least 100g portions of a pinned food
 
-        if self.limits.get('allergies')[0] == 'lactose':
-            self.df = self.df[self.df['lactose'] == 0]
+        allergies = [allergy for allergy in self.limits.get('allergies', []) if allergy]
+        if allergies:
+            with metrics.timer('allergy_filtering', rows=len(self.catalog)):
+                self.available &= ~self.catalog.get_allergen_mask(allergies)
 
-        print(f'All Meals:   {len(self.df)}')
-        print(
-            f'Used Meals:  {len(used_meals if used_meals is not None else [])}')
         if used_meals is not None:
-            remove_n = int(round(len(used_meals)*0.2))
-            drop_indices = np.random.choice(
-                used_meals.index, remove_n, replace=False)
-            used_meals.drop(drop_indices, inplace=True)
-            self.df.drop(used_meals.index, inplace=True)
-            print(f'Removed {remove_n} foods from the used_meals list')
-        print(f'All - Used = {len(self.df)}')
+            with metrics.timer('used_meal_removal', rows=int(used_meals.excluded.sum()),
+                               readmitted=used_meals.readmitted):
+                self.available &= ~used_meals.excluded
+        self.candidates = self.available.copy()  # Before the previous day's categories
 
         if prev_meal_plan != None:
             self.remove_previous_meal_plan_categories(prev_meal_plan)
@@ -43,6 +194,7 @@ class DailyMealPlan():
             'protein_kcal_limit', self.kcal_limit*0.3, limits)
         self.fat_kcal_limit = get_limit(
             'fat_kcal_limit', self.kcal_limit*0.2, limits)
+        self.food_limit = get_limit('food_limit', FOOD_BOUNDS[1], limits)  # 100g portions of one food
 
         # Extra
         if self.limits.get('low_salt'):
@@ -50,93 +202,502 @@ class DailyMealPlan():
             self.sodium_limit = get_limit('sodium_limit', 2000, limits)
 
     def remove_previous_meal_plan_categories(self, prev_meal_plan):
+        """
+        Excludes the categories of the previous day's meal plan. Can be called again after
+        the previous day has changed, as the exclusions are always made from self.candidates.
+        """
         prev_df = prev_meal_plan.get_optimal_meal_plan()[
             ['category', 'extra_category']]
 
-        prev_cat = prev_df['category'].tolist()
-        self.df = self.df[~self.df['category'].isin(prev_cat)]
+        with metrics.timer('category_exclusion') as stage:
+            rows = self.catalog.get_category_rows(
+                prev_df['category'].unique(), prev_df['extra_category'].unique())
+            self.available = self.candidates & ~self.swapped_out
+            self.available[rows] = False
+            # A pinned food stays on its day even if it now shares a category with the previous day
+            self.available[list(self.pinned)] = True
+            stage['rows'] = len(rows)
+        self.invalidate()
 
-        prev_extra_cat = list(
-            filter(lambda a: a != '', prev_df['extra_category'].tolist()))
-        self.df = self.df[~self.df['extra_category'].isin(prev_extra_cat)]
+    def get_rows(self, foods):
+        """Catalog rows of the foods, given by their index labels as in get_optimal_meal_plan()"""
+        rows = self.catalog.get_positions(foods)
+        if (rows < 0).any():
+            raise ValueError(f'Unknown foods: {list(np.asarray(foods)[rows < 0])}')
+        return rows
 
-    def calculate_optimal_meal_plan(self):
-        self.df['count'] = 1
-        # Mandatory
-        sugar = self.df['sugar']
-        fibre = self.df['fibre']
-        kcal = self.df['kcal']
-        carb_kcal = self.df['carb_kcal']
-        protein_kcal = self.df['protein_kcal']
-        fat_kcal = self.df['fat_kcal']
-        count = self.df['count']
+    def exclude_foods(self, foods):
+        """Swaps the foods out of the day's meal plan. Call reoptimize() to re-solve the day."""
+        rows = self.get_rows(foods)
+        self.swapped_out[rows] = True
+        self.available[rows] = False
+        for row in rows:
+            self.pinned.pop(row, None)
+        self.invalidate()
 
-        # Extra
-        if self.limits.get('low_salt'):
-            salt = self.df['salt']  # (mg)
-            sodium = self.df['sodium']  # (mg)
+    def pin_foods(self, foods, grams=None):
+        """
+        Keeps the foods in the day's meal plan, at least the given grams of each.
+        By default at least as much as the current meal plan has, or 10g.
+        Call reoptimize() to re-solve the day.
+        """
+        rows = self.get_rows(foods)
+        if not self.available[rows].all():
+            raise ValueError(f'Foods not available on day {self.day}: '
+                             f'{list(np.asarray(foods)[~self.available[rows]])}')
+        if grams is None:
+            grams = 10 if self.grams is None else np.maximum(self.grams[rows], 10)
+        portions = np.broadcast_to(np.asarray(grams, dtype=np.float64) / 100, rows.shape)
+        if (portions > self.food_limit).any():
+            raise ValueError(f'A food can be pinned to at most {self.food_limit * 100:g}g')
+        self.pinned.update(zip(rows.tolist(), portions.tolist()))
+        self.invalidate()
 
-            A_upperbounds = np.array([count, -fibre, sodium, salt])
+    def reoptimize(self):
+        """
+        Re-solves the day after its foods have been changed.
+        Raises MealPlanError if no meal plan satisfies the changes.
+        """
+        self.calculate_optimal_meal_plan()
+
+    def get_categories(self):
+        """The categories and extra categories of the meal plan, which the next day excludes"""
+        meal_plan = self.get_optimal_meal_plan()
+        return set(meal_plan['category']), set(meal_plan['extra_category']) - {''}
+
+    def get_constraint_bounds(self):
+        """The limits side of the LP: b_ub and b_eq matching the MealPlanModel rows"""
+        if self.limits.get('low_salt'):
             b_upperbounds = np.array(
-                [13, -self.fibre_limit, self.sodium_limit, self.salt_limit])
+                [MAX_FOOD_COUNT, -self.fibre_limit, self.sodium_limit, self.salt_limit], dtype=np.float64)
         else:
-            A_upperbounds = np.array([count, -fibre])
-            b_upperbounds = np.array([13, -self.fibre_limit])
-
-        A_equality = np.array([
-            kcal, carb_kcal, protein_kcal, fat_kcal
-        ])
+            b_upperbounds = np.array([MAX_FOOD_COUNT, -self.fibre_limit], dtype=np.float64)
         b_equality = np.array(
-            [self.kcal_limit, self.carb_kcal_limit, self.protein_kcal_limit, self.fat_kcal_limit])
-        bounds = [(0, 5) for x in range(self.df.shape[0])]
-        solution = linprog(
-            c=sugar,
-            A_ub=A_upperbounds,
-            b_ub=b_upperbounds,
-            A_eq=A_equality,
-            b_eq=b_equality,
-            bounds=bounds
-        )
-        self.df['grams'] = solution.x[solution.x > 0] * 100
+            [self.kcal_limit, self.carb_kcal_limit, self.protein_kcal_limit, self.fat_kcal_limit],
+            dtype=np.float64)
+        return b_upperbounds, b_equality
+
+    def get_food_bounds(self):
+        """(0, 5) for the available foods, (0, 0) for the excluded ones and (pinned, 5) for the pinned ones"""
+        bounds = np.zeros((len(self.catalog), 2))
+        bounds[self.available, 1] = self.food_limit
+        if self.pinned:
+            bounds[list(self.pinned), 0] = list(self.pinned.values())
+        return bounds
+
+    def calculate_optimal_meal_plan(self):
+        if self.model is None:
+            self.model = MealPlanModel(self.catalog, low_salt=self.limits.get('low_salt'))
+        b_upperbounds, b_equality = self.get_constraint_bounds()
+        bounds = self.get_food_bounds()
+
+        with metrics.timer('presolve', rows=int(self.available.sum())):
+            violations = self.model.check_limits(b_upperbounds, b_equality, bounds)
+        if violations:
+            metrics.increment('presolve_rejections_total')
+            raise MealPlanError(f'No meal plan found for day {self.day}: ' + ', '.join(
+                f"{v['constraint']} {v['type']} {v['limit']:g} is out of reach "
+                f"({v['min']:g}-{v['max']:g})" for v in violations), violations)
+
+        if self.cache is not None:
+            cache_key = plan_cache.get_plan_key(
+                self.model.version, b_upperbounds, b_equality, bounds, self.method)
+            cached_solution = self.cache.get(cache_key)
+            if cached_solution is not None:
+                metrics.increment('lp_cache_hits_total')
+                self.solution = cached_solution
+                self.solve_time = 0.0
+                self.set_optimal_solution(self.solution.x)
+                return
+
+        start = time.time()
+        self.solution = self.model.solve(b_upperbounds, b_equality, bounds=bounds, method=self.method)
+        self.solve_time = time.time() - start
+        metrics.record('lp_solve', self.solve_time, rows=int(self.available.sum()),
+                       status=int(self.solution.status), iterations=int(self.solution.nit), method=self.method)
+        metrics.increment('lp_solves_total', status=int(self.solution.status))
+        metrics.increment('lp_iterations_total', int(self.solution.nit))
+
+        if self.solution.status != 0:
+            raise MealPlanError(f'No meal plan found for day {self.day}: {self.solution.message}')
+        if self.cache is not None:
+            self.cache.put(cache_key, self.solution)
+        self.set_optimal_solution(self.solution.x)
+
+    def set_optimal_solution(self, x):
+        """Stores x (100g portions of every food in the catalog) as the optimal meal plan"""
+        self.grams = x * 100
         self.daily_meal_plan_calculated = True
+        self.optimal_meal_plan = None
+        self.total_nutrients = None
+
+    def get_state(self):
+        """The excluded and pinned foods and the solution, for restore_state"""
+        return {
+            'available': self.available.copy(),
+            'swapped_out': self.swapped_out.copy(),
+            'pinned': dict(self.pinned),
+            'solution': self.solution,
+            'grams': self.grams,
+        }
+
+    def restore_state(self, state):
+        """Undoes the changes made since get_state, e.g. after a swap that could not be solved"""
+        self.available = state['available'].copy()
+        self.swapped_out = state['swapped_out'].copy()
+        self.pinned = dict(state['pinned'])
+        self.solution = state['solution']
+        if state['grams'] is None:
+            self.grams = None
+            self.invalidate()
+        else:
+            self.set_optimal_solution(state['grams'] / 100)
+
+    def invalidate(self):
+        """Forgets the solution, e.g. after the limits or the excluded foods have changed"""
+        self.daily_meal_plan_calculated = False
+        self.optimal_meal_plan = None
+        self.total_nutrients = None
+
+    def get_meal_rows(self):
+        """Catalog rows of the foods in the optimal meal plan"""
+        if not self.daily_meal_plan_calculated:
+            self.calculate_optimal_meal_plan()
+        # taking only recommendations over 10 grams
+        return np.nonzero(self.grams >= 10)[0]
 
     def get_optimal_meal_plan(self):
+        """
+        The foods of the optimal meal plan with their nutrients for the planned grams.
+        Calculated once per solution, so the returned df must not be modified.
+        """
         if not self.daily_meal_plan_calculated:
             # logger.info("Optimizing today's meal plan...")
             self.calculate_optimal_meal_plan()
+        if self.optimal_meal_plan is not None:
+            return self.optimal_meal_plan
+
         info = ['name', 'count', 'grams', 'kcal', 'sugar', 'fibre', 'carb_kcal',
                 'protein_kcal', 'fat_kcal', 'salt', 'sodium', 'category',
                 'extra_category', 'lactose']
-        df = self.df[info].copy()
-
-        # Calculating meal plans nutrient quantities for each food
         nutrients = ['fibre', 'sugar', 'kcal', 'carb_kcal',
                      'protein_kcal', 'fat_kcal', 'salt', 'sodium', 'lactose']
-        # Rounding to nearest 10g and each nutrient is per 100g
-        df_grams = df['grams'].round(-1).div(100)
-        df[nutrients] = df[nutrients].multiply(df_grams, axis='index')
-        df.sort_values(by='grams', ascending=False, inplace=True)
 
-        df = df[df['grams'] >= 10]  # taking only recommendations over 10 grams
-        df['grams'] = df['grams'].round(-1)  # Rounding to nearest 10g
+        with metrics.timer('post_processing') as stage:
+            grams = self.grams
+            rows = self.get_meal_rows()
+            df = self.catalog.to_dataframe(rows)
+            df['count'] = 1
+            df['grams'] = grams[rows]
+            df = df[info]
+
+            # Calculating meal plans nutrient quantities for each food
+            # Rounding to nearest 10g and each nutrient is per 100g
+            portions = np.round(grams[rows], -1) / 100
+            df[nutrients] = df[nutrients].to_numpy(dtype=np.float64) * portions[:, np.newaxis]
+            df.sort_values(by='grams', ascending=False, inplace=True)
+            df['grams'] = df['grams'].round(-1)  # Rounding to nearest 10g
+            stage['rows'] = len(df)
+
+        self.optimal_meal_plan = df
         return df
 
+    def get_sensitivity(self):
+        """
+        Every limit of the solved day with the planned amount, the slack (how far the plan is
+        from the limit) and the dual value: the change of the day's sugar per one unit more
+        of the limit. Only the HiGHS methods report the dual values, otherwise they are NaN.
+        """
+        if not self.daily_meal_plan_calculated:
+            self.calculate_optimal_meal_plan()
+        x = self.grams / 100
+        b_upperbounds, b_equality = self.get_constraint_bounds()
+        ineqlin = getattr(self.solution, 'ineqlin', None)
+        eqlin = getattr(self.solution, 'eqlin', None)
+        ub_duals = ineqlin.marginals if ineqlin is not None else np.full(len(b_upperbounds), np.nan)
+        eq_duals = eqlin.marginals if eqlin is not None else np.full(len(b_equality), np.nan)
+
+        signs = self.model.ub_signs
+        limits = np.concatenate([signs * b_upperbounds, b_equality])
+        values = np.concatenate([signs * (self.model.A_ub @ x), self.model.A_eq @ x])
+        return pd.DataFrame({
+            'type': [('<=' if sign > 0 else '>=') for sign in signs] + ['=='] * len(b_equality),
+            'limit': limits,
+            'value': values,
+            'slack': np.abs(limits - values),
+            'dual': np.concatenate([signs * ub_duals, eq_duals]),
+        }, index=self.model.ub_names + self.model.eq_names)
+
     def get_total_nutrients(self):
-        columns = ['count', 'grams', 'fibre', 'sugar', 'kcal',
-                   'carb_kcal', 'protein_kcal', 'fat_kcal', 'salt', 'sodium', 'lactose']
-        return self.get_optimal_meal_plan()[columns].sum()
+        if self.total_nutrients is None:
+            columns = ['count', 'grams', 'fibre', 'sugar', 'kcal',
+                       'carb_kcal', 'protein_kcal', 'fat_kcal', 'salt', 'sodium', 'lactose']
+            self.total_nutrients = self.get_optimal_meal_plan()[columns].sum()
+        return self.total_nutrients
+
+    def to_dict(self):
+        """
+        The meal plan and its total nutrients ready for JSON, rounded to 0.1 like on the page.
+        The foods are given column by column, 'id' being the food's index label in the catalog.
+        """
+        meal_plan = self.get_optimal_meal_plan().round(1)
+        foods = {'id': meal_plan.index.tolist()}
+        foods.update((column, meal_plan[column].tolist()) for column in meal_plan.columns)
+        total = self.get_total_nutrients().round(1)
+        return {
+            'day': self.day,
+            'foods': foods,
+            'total': {name: float(value) for name, value in total.items()},
+        }
+
+    def get_csv_directory(self, directory=None):
+        if directory is not None:
+            return directory
+        return 'daily_meal_plans/new_low_salt' if self.limits.get('low_salt') else 'daily_meal_plans/new'
 
-    def save_total_nutrients_to_csv(self):
+    def save_total_nutrients_to_csv(self, directory=None):
+        directory = self.get_csv_directory(directory)
         if self.limits.get('low_salt'):
-            csv_path = f'daily_meal_plans/new_low_salt/{self.day}_nutrients_low_salt.csv'
+            csv_path = f'{directory}/{self.day}_nutrients_low_salt.csv'
         else:
-            csv_path = f'daily_meal_plans/new/{self.day}_nutrients.csv'
+            csv_path = f'{directory}/{self.day}_nutrients.csv'
 
-        self.get_total_nutrients().to_csv(csv_path)
+        total_nutrients = self.get_total_nutrients()
+        with metrics.timer('csv_write', rows=1):
+            total_nutrients.to_csv(csv_path)
 
-    def save_meal_plan_to_csv(self):
+    def save_meal_plan_to_csv(self, directory=None):
+        directory = self.get_csv_directory(directory)
         if self.limits.get('low_salt'):
-            csv_path = f'daily_meal_plans/new_low_salt/{self.day}_meal_plan_low_salt.csv'
+            csv_path = f'{directory}/{self.day}_meal_plan_low_salt.csv'
         else:
-            csv_path = f'daily_meal_plans/new/{self.day}_meal_plan.csv'
-        self.get_optimal_meal_plan().to_csv(csv_path)
+            csv_path = f'{directory}/{self.day}_meal_plan.csv'
+        meal_plan = self.get_optimal_meal_plan()
+        with metrics.timer('csv_write', rows=len(meal_plan)):
+            meal_plan.to_csv(csv_path)
+
+
+class MultiDayMealPlanner():
+    """
+    Plans successive days on one LP model built once over the whole catalog.
+
+    Each day differs from the previous one only in its food bounds, so only the
+    bounds are built per day. Every day is still solved from scratch: linprog's
+    default methods (interior point, HiGHS) can not be warm started.
+    The foods of the previous days are excluded by a variety.VarietyTracker;
+    with a seed the plans are reproducible (and so served from the plan cache).
+    """
+
+    def __init__(self, df_meals, limits={}, method=DEFAULT_SOLVER_METHOD, seed=None):
+        self.catalog = catalog.as_catalog(df_meals)
+        self.limits = limits
+        self.method = method
+        self.seed = seed
+        self.model = MealPlanModel(self.catalog, low_salt=limits.get('low_salt'))
+
+    def get_daily_meal_plans(self, days, first_day=0, previous_day=None):
+        """
+        Yields the DailyMealPlan of every day, each one solved already.
+        The days are named from first_day on, and the first one excludes the categories of previous_day.
+        """
+        used_meals = variety.VarietyTracker(len(self.catalog), seed=self.seed)
+        for day_count in range(days):
+            day = DailyMealPlan(
+                self.catalog,
+                limits=self.limits,
+                day=str(first_day + day_count),
+                prev_meal_plan=previous_day,
+                used_meals=used_meals,
+                method=self.method,
+                model=self.model)
+            day.calculate_optimal_meal_plan()
+
+            used_meals.record(day.get_meal_rows())
+            yield day
+            previous_day = day
+
+    def swap_foods(self, daily_meal_plans, day_count, exclude=(), pin=()):
+        """
+        Changes one day of the solved daily_meal_plans (from get_daily_meal_plans):
+        excludes and pins the foods (index labels) and re-solves only that day.
+        The following day is re-solved only if the categories it excludes have changed,
+        and so on. The used meals of the following days are not recalculated.
+        Returns the days that changed, e.g. for saving them again.
+        If any of the days can not be solved, all of them are left as they were and
+        the MealPlanError (or ValueError for unknown or unavailable foods) is raised.
+        """
+        day = daily_meal_plans[day_count]
+        states = []  # (day, its state before the swap) of every day changed so far
+        with metrics.timer('food_swap') as stage:
+            try:
+                categories = day.get_categories()
+                states.append((day, day.get_state()))
+                if len(exclude):
+                    day.exclude_foods(exclude)
+                if len(pin):
+                    day.pin_foods(pin)
+                day.reoptimize()
+                changed = [day]
+                for next_day in daily_meal_plans[day_count + 1:]:
+                    if day.get_categories() == categories:
+                        break
+                    categories = next_day.get_categories()
+                    states.append((next_day, next_day.get_state()))
+                    next_day.remove_previous_meal_plan_categories(day)
+                    next_day.reoptimize()
+                    changed.append(next_day)
+                    day = next_day
+            except (MealPlanError, ValueError):
+                for changed_day, state in states:
+                    changed_day.restore_state(state)
+                raise
+            stage['rows'] = len(changed)
+        return changed
+
+
+class WeeklyMealPlanner():
+    """
+    Plans a week at a time as one block structured MILP instead of greedily day by day.
+
+    Every day is one block of the daily LP. The blocks are coupled by
+    - binary indicators per day for every category and extra_category,
+      of which two consecutive days can not both be on, and
+    - a cap on how much of a single food can be eaten during the week.
+
+    Plans longer than a week are solved week by week, the first day of a week
+    excluding the categories of the previous week's last day.
+    A week the MILP finds no solution for within time_limit, a week with more than max_foods
+    available foods (None for no limit), and every week without scipy.optimize.milp (scipy < 1.9),
+    is planned day by day by MultiDayMealPlanner instead. The first days of those weeks are
+    listed in fallback_weeks.
+    """
+
+    def __init__(self, df_meals, limits={}, food_week_limit=FOOD_BOUNDS[1], time_limit=WEEKLY_TIME_LIMIT,
+                 max_foods=catalog.WEEKLY_MAX_FOODS, method=DEFAULT_SOLVER_METHOD):
+        self.catalog = catalog.as_catalog(df_meals)
+        self.limits = limits
+        self.food_week_limit = food_week_limit  # 100g portions of one food per week
+        self.time_limit = time_limit  # seconds per week, MILP only
+        self.max_foods = max_foods
+        self.method = method  # linprog method of the day by day fallback
+        self.solve_times = []
+        self.fallback_weeks = []  # First days of the weeks planned day by day
+
+    def get_daily_meal_plans(self, days):
+        """Yields the DailyMealPlan of every day, each one solved already"""
+        previous_day = None
+        for first_day in range(0, days, 7):
+            for day in self.get_weekly_meal_plan(first_day, min(7, days - first_day), previous_day):
+                yield day
+                previous_day = day
+
+    def get_group_matrix(self, food_catalog):
+        """(group x food) membership of every category and non-empty extra_category"""
+        n_categories = len(food_catalog.categories)
+        has_extra = food_catalog.extra_categories[food_catalog.extra_category_codes] != ''
+        rows = np.concatenate([food_catalog.category_codes,
+                               n_categories + food_catalog.extra_category_codes[has_extra]])
+        cols = np.concatenate([np.arange(len(food_catalog)), np.nonzero(has_extra)[0]])
+        groups = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)),
+                                   shape=(n_categories + len(food_catalog.extra_categories), len(food_catalog)))
+        return groups[np.diff(groups.indptr) > 0]  # Without the empty extra_category
+
+    def get_fallback_meal_plan(self, first_day, days, prev_meal_plan, reason):
+        logging.warning(f'Planning days {first_day}-{first_day + days - 1} day by day: {reason}')
+        metrics.increment('weekly_fallbacks_total')
+        self.fallback_weeks.append(first_day)
+        planner = MultiDayMealPlanner(self.catalog, limits=self.limits, method=self.method)
+        return list(planner.get_daily_meal_plans(days, first_day=first_day, previous_day=prev_meal_plan))
+
+    def get_weekly_meal_plan(self, first_day, days, prev_meal_plan=None):
+        if milp is None:
+            return self.get_fallback_meal_plan(first_day, days, prev_meal_plan, 'no MILP solver in scipy < 1.9')
+        template = DailyMealPlan(self.catalog, limits=self.limits, day=str(first_day))
+        n_available = int(template.available.sum())
+        if self.max_foods is not None and n_available > self.max_foods:
+            return self.get_fallback_meal_plan(
+                first_day, days, prev_meal_plan, f'{n_available} foods, more than the MILP solves in time')
+        model = MealPlanModel(self.catalog, low_salt=self.limits.get('low_salt'))
+        b_upperbounds, b_equality = template.get_constraint_bounds()
+        n_foods = len(self.catalog)
+
+        available = np.tile(template.available, (days, 1))
+        if prev_meal_plan is not None:
+            template.remove_previous_meal_plan_categories(prev_meal_plan)
+            available[0] = template.available
+
+        groups = self.get_group_matrix(self.catalog)
+        groups = groups[np.asarray(groups @ available.any(axis=0)).ravel() > 0]
+        n_groups = groups.shape[0]
+        # The most a day can eat of one group, so the indicator being on never limits the group
+        group_max = np.minimum(MAX_FOOD_COUNT, FOOD_BOUNDS[1] * np.asarray(groups.sum(axis=1)).ravel())
+
+        day_identity = sparse.identity(days, format='csr')
+        consecutive = sparse.diags([1, 1], [0, 1], shape=(days - 1, days), format='csr')
+        zeros = sparse.csr_matrix
+
+        # Variables: x (days x foods) followed by the indicators (days x groups)
+        A_ub = sparse.vstack([
+            sparse.hstack([sparse.kron(day_identity, sparse.csr_matrix(model.A_ub)),
+                           zeros((days * model.A_ub.shape[0], days * n_groups))]),
+            sparse.hstack([sparse.kron(day_identity, groups),
+                           sparse.kron(day_identity, sparse.diags(-group_max))]),
+            sparse.hstack([zeros(((days - 1) * n_groups, days * n_foods)),
+                           sparse.kron(consecutive, sparse.identity(n_groups))]),
+            sparse.hstack([sparse.kron(np.ones((1, days)), sparse.identity(n_foods)),
+                           zeros((n_foods, days * n_groups))]),
+        ], format='csr')
+        b_ub = np.concatenate([
+            np.tile(b_upperbounds, days),
+            np.zeros(days * n_groups),
+            np.ones((days - 1) * n_groups),
+            np.full(n_foods, self.food_week_limit, dtype=np.float64),
+        ])
+        A_eq = sparse.hstack([sparse.kron(day_identity, sparse.csr_matrix(model.A_eq)),
+                              zeros((days * model.A_eq.shape[0], days * n_groups))], format='csr')
+        b_eq = np.tile(b_equality, days)
+
+        c = np.concatenate([np.tile(model.c, days), np.zeros(days * n_groups)])
+        upper = np.concatenate([(available * FOOD_BOUNDS[1]).ravel(), np.ones(days * n_groups)])
+
+        start = time.time()
+        integrality = np.concatenate([np.zeros(days * n_foods), np.ones(days * n_groups)])
+        solution = milp(
+            c,
+            integrality=integrality,
+            bounds=Bounds(np.zeros(len(c)), upper),
+            constraints=[LinearConstraint(A_ub, -np.inf, b_ub),
+                         LinearConstraint(A_eq, b_eq, b_eq)],
+            options={'time_limit': self.time_limit})
+        self.solve_times.append(time.time() - start)
+        metrics.record('weekly_solve', self.solve_times[-1], rows=len(c),
+                       status=int(solution.status), days=days)
+        metrics.increment('weekly_solves_total', status=int(solution.status))
+        if solution.x is None:
+            # E.g. the time limit was reached before any integer solution was found.
+            # A solution found by then is kept, even if it is not proven optimal.
+            return self.get_fallback_meal_plan(first_day, days, prev_meal_plan, solution.message)
+
+        daily_meal_plans = []
+        for day_count in range(days):
+            day = DailyMealPlan(self.catalog, limits=self.limits, day=str(first_day + day_count), model=model)
+            day.available = available[day_count]
+            day.set_optimal_solution(solution.x[day_count * n_foods:(day_count + 1) * n_foods])
+            daily_meal_plans.append(day)
+        return daily_meal_plans
+
+
+def time_solver_methods(df_meals, limits={}, methods=SOLVER_METHODS):
+    """Solve time of one day per linprog method, for picking the fastest one for a catalog"""
+    solve_times = {}
+    food_catalog = catalog.as_catalog(df_meals)
+    for method in methods:
+        day = DailyMealPlan(food_catalog, limits=limits, method=method, cache=None)
+        try:
+            day.calculate_optimal_meal_plan()
+        except MealPlanError:
+            raise  # The limits out of reach or the method failed, not an unknown method
+        except ValueError:
+            continue  # Method not supported by the installed scipy
+        solve_times[method] = day.solve_time
+    return solve_times
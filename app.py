@@ -1,18 +1,39 @@
-from flask import Flask, request, redirect, url_for
-from flask import render_template
-import pandas as pd
-import data_import
-import algorithm
-import glob
-import time
-import random
+from flask import Flask, request, redirect, url_for, Response
+from flask import render_template, jsonify
+import catalog
+import plan_cache
+import metrics
+import plan_store
+import jobs
+import os
+import json
+import gzip
+import math
 import logging
 logging.basicConfig(format='%(message)s', level=logging.INFO)
 
 LOCAL = DEBUG = True  # False is only for production
+API_MAX_DAYS = 30
+API_MIN_GZIP_SIZE = 1024  # bytes
 
 app = Flask(__name__)
 
+# "Plan whole weeks" is offered only for catalogs the weekly MILP can plan in time
+can_plan_weeks = False
+if os.path.exists(os.path.join(catalog.CACHE_DIR, 'meta.json')):
+    # Map the prebuilt catalog once, before gunicorn (--preload) forks the workers
+    can_plan_weeks = len(catalog.get_catalog()) <= catalog.WEEKLY_MAX_FOODS
+
+meal_plan_store = plan_store.PlanStore()
+meal_plan_store.preload()
+job_queue = jobs.JobQueue()
+api_cache = plan_cache.PlanCache(max_size=64)  # Request key -> (etag, body, gzipped body)
+
+
+@app.context_processor
+def inject_can_plan_weeks():
+    return {'can_plan_weeks': can_plan_weeks}
+
 
 @app.route('/')
 def home():
@@ -26,51 +47,28 @@ def login():
     return render_template('index.html', wrong_password=True)
 
 
-def calculate(days, allergy, low_salt):
-    df = data_import.get_data()
-    df = data_import.clean_data(df)
-
-    previous_day = None
-    used_meals = None
-    start = time.time()
-    for day_count in range(days):
-        day_name = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun'][day_count % 7]
-        day_name = str(day_count) + ''
-        day = algorithm.DailyMealPlan(
-            df, 
-            limits={'allergies': [allergy], 'low_salt':low_salt},
-            day=day_name,
-            prev_meal_plan=previous_day, 
-            used_meals=used_meals)
-        message = ' '.join(['-'*20, 'Meal Plan:', day_name.upper(), '-'*20])
-        logging.info(message)
-        meal_plan = day.get_optimal_meal_plan()
-        logging.info(meal_plan)
-
-        used_meals = pd.concat([used_meals, meal_plan])
-        day.save_meal_plan_to_csv()
-        day.save_total_nutrients_to_csv()
-        logging.info(day.get_total_nutrients())
-        previous_day = day
-
-    end = time.time()
-    message = ' '.join(['-'*20, 'Running time:', str(end - start), '-'*20])
-    logging.info(message)
-    return 
-
-
 @app.route('/upadate-meal-plan', methods=['GET', 'POST'])
 def update_meal_plan():
     if not request.form.get('days'):
         return redirect(url_for('meal_plan'))
     days = request.form.get('days')
+    if not days.isdigit() or not 1 <= int(days) <= API_MAX_DAYS:
+        return redirect(url_for('meal_plan'))
     days = int(days)
     allergy = 'lactose' if request.form.get('allergy') else ''
     low_salt = True if request.form.get('low_salt') else False
     min_sugar = True if request.form.get('min_sugar') else False
     new_meal_plan = True if request.form.get('new_meal_plan') else False
+    joint_week = True if request.form.get('joint_week') else False
     if new_meal_plan and LOCAL:
-        calculate(days, allergy, low_salt)
+        # Toggling a variant on a job's page shows the sibling job planned along with it
+        job_id = request.form.get('job_id')
+        job_id = job_id and job_queue.get_sibling(job_id, days, allergy, low_salt, joint_week=joint_week)
+        if job_id:
+            metrics.increment('job_sibling_hits_total')
+        else:
+            job_id = job_queue.submit(days, allergy, low_salt, joint_week=joint_week)
+        return redirect(url_for('meal_plan_job', job_id=job_id))
     elif new_meal_plan and not LOCAL:
         meal_plans, nutrients = get_nutrients_and_meal_plans(
             days, allergy=allergy, low_salt=low_salt, min_sugar=min_sugar, new_meal_plan=False)
@@ -81,6 +79,47 @@ def update_meal_plan():
     return render_template('meal_plan.html', meal_plans=meal_plans, nutrients=nutrients, days=days)
 
 
+@app.route('/meal-plan-jobs', methods=['POST'])
+def submit_meal_plan_job():
+    params = request.get_json(silent=True) or request.form
+    try:
+        days = int(params.get('days', 7))
+    except (TypeError, ValueError):
+        return jsonify(error='days must be an integer'), 400
+    if not 1 <= days <= API_MAX_DAYS:
+        return jsonify(error=f'days must be between 1 and {API_MAX_DAYS}'), 400
+    allergy = 'lactose' if params.get('allergy') else ''
+    low_salt = True if params.get('low_salt') else False
+    joint_week = True if params.get('joint_week') else False
+    siblings = params.get('siblings') not in [False, '0', 'false']
+    job_id = job_queue.submit(days, allergy, low_salt, joint_week=joint_week, siblings=siblings)
+    return jsonify(job_id=job_id, status_url=url_for('meal_plan_job_status', job_id=job_id)), 202
+
+
+@app.route('/meal-plan-jobs/<job_id>')
+def meal_plan_job_status(job_id):
+    status = job_queue.get_status(job_id)
+    if status is None:
+        return jsonify(error='Unknown job'), 404
+    return jsonify(status)
+
+
+@app.route('/meal-plan-jobs/<job_id>/meal-plan')
+def meal_plan_job(job_id):
+    status = job_queue.get_status(job_id)
+    if status is None:
+        return redirect(url_for('meal_plan'))
+    days = status['days']
+    if status['status'] == 'done':
+        meal_plans, nutrients = job_queue.get_nutrients_and_meal_plans(job_id)
+    else:
+        # Until the job is done, show the pre-calculated meal plans
+        meal_plans, nutrients = get_nutrients_and_meal_plans(
+            days, allergy=status['allergy'], low_salt=status['low_salt'])
+    return render_template('meal_plan.html', meal_plans=meal_plans, nutrients=nutrients, days=days,
+                           job_id=job_id, job_status=status['status'], fallback_weeks=status.get('fallback_weeks'))
+
+
 @app.route('/meal-plan')
 @app.route('/meal-plan/<days>', methods=['GET', 'POST'])
 def meal_plan(days=7):
@@ -89,77 +128,108 @@ def meal_plan(days=7):
     return render_template('meal_plan.html', meal_plans=meal_plans, nutrients=nutrients, days=days)
 
 def get_nutrients_and_meal_plans(days, allergy=None, low_salt=None, min_sugar=True, new_meal_plan=False):
-    def convert_info_to_list_of_dicts(info_dict, min_sugar, days):
-        if min_sugar:
-            sorted_tuples = sorted(info_dict.items())
-        else:
-            sorted_tuples = sorted(info_dict.items())
-            # TODO: Commenting this because then there might be same food category on successive days
-            # Have to figure another way to shuffle the meal plans (algorithm level solution)
-            # sorted_tuples = sorted(info_dict.items(), key=lambda x: random.random())
-
-        info_list = []
-        count = 1
-        for i, value in sorted_tuples:
-            info_list.append(value)
-            if count == days:
-                break
-            count += 1
-        return info_list
-    
-    # Meal Plans
-    meal_plans_dict = {}
-    if new_meal_plan:
-        if low_salt:
-            path = "daily_meal_plans/new_low_salt/*meal_plan*.csv"
-        else:
-            path = "daily_meal_plans/new/*meal_plan.csv"
+    # NOTE: min_sugar does not change the order of the days.
+    # Shuffling them might put the same food category on successive days,
+    # so that has to be solved on the algorithm level.
+    return meal_plan_store.get_nutrients_and_meal_plans(
+        days, allergy=allergy, low_salt=low_salt, new_meal_plan=new_meal_plan)
+
+
+def get_api_meal_plan(food_catalog, days, limits, seed):
+    """
+    Returns the (etag, body, gzipped body) of the JSON response: the nearest plans of the
+    precomputed plan library if there are any, else the days planned in process.
+    served_limits are the limits the plans meet: the library's plans may have a macro
+    split up to plan_library.SPLIT_TOLERANCE off the requested one.
+    The ETag is the hash of the plan, so it changes only when the planned foods change.
+    """
+    import algorithm  # The solver stack (scipy) is loaded on the first optimization only
+    import plan_library
+    daily_meal_plans = None
+    library = plan_library.get_library() if seed == plan_library.SEED else None
+    if library is not None:
+        daily_meal_plans = library.get_daily_meal_plans(food_catalog, limits, days)
+    source = 'library'
+    served_limits = limits
+    if daily_meal_plans is not None:
+        served_limits = daily_meal_plans[0].limits
     else:
-        if low_salt:
-            path = "daily_meal_plans/pre_low_salt/*meal_plan_low_salt.csv"
-        else:
-            path = "daily_meal_plans/pre/*meal_plan.csv"
-    i = 1
-    for fname in glob.glob(path):
-        df = pd.read_csv(fname, sep=",")
-        df = df.append(df.sum(numeric_only=True), ignore_index=True)
-        df.loc[df.index[-1], 'name'] = 'Total'
-        if allergy and df['lactose'].iloc[-1] != 0:
-            continue # TODO: this causes a slight change of same food category on successive days
-                     # This can be fixed in the algorithm level
-        df['salt'] = df['salt'].div(1000) # mg -> g
-        key = int(fname.split('/')[-1].split('_')[0])
-        meal_plans_dict[key] = df.round(1).to_dict('list')
-        # meal_plans_dict[df['sugar'].iloc[-1]] = df.round(1).to_dict('list')
-        i += 1
-    meal_plans = convert_info_to_list_of_dicts(meal_plans_dict, min_sugar, days)
-
-    # Nutrients
-    nutrients_dict = {}
-    if new_meal_plan:
-        if low_salt:
-            path = "daily_meal_plans/new_low_salt/*nutrients*.csv"
-        else:
-            path = "daily_meal_plans/new/*nutrients.csv"
+        planner = algorithm.MultiDayMealPlanner(food_catalog, limits=limits, seed=seed)
+        daily_meal_plans = planner.get_daily_meal_plans(days)
+        source = 'optimizer'
+    meal_plans = [day.to_dict() for day in daily_meal_plans]
+
+    body = json.dumps({
+        'catalog_version': food_catalog.version,
+        'limits': limits,
+        'served_limits': served_limits,
+        'seed': seed,
+        'source': source,
+        'meal_plans': meal_plans,
+    }, separators=(',', ':')).encode('utf-8')
+    etag = plan_cache.get_plan_key(body)[:32]
+    return etag, body, gzip.compress(body)
+
+
+@app.route('/api/meal-plan')
+def api_meal_plan():
+    """
+    The meal plans of ?days=7 with their nutrient totals as JSON, optionally with &kcal_limit=2000,
+    the carb, protein and fat shares of the kcal (&carb_share=0.5&protein_share=0.3&fat_share=0.2),
+    &allergies=lactose,gluten,nuts, &low_salt=1 and &seed=0.
+    Plans are deterministic for a seed, so a repeated request is served from memory
+    and answered with 304 Not Modified when its ETag matches.
+    """
+    import algorithm
+    params = request.args
+    try:
+        days = int(params.get('days', 7))
+        seed = int(params.get('seed', 0))
+        kcal_limit = float(params.get('kcal_limit', 2000))
+        shares = [float(params.get(f'{macro}_share', default))
+                  for macro, default in [('carb', 0.5), ('protein', 0.3), ('fat', 0.2)]]
+    except ValueError:
+        return jsonify(error='days and seed must be integers, kcal_limit and the shares numbers'), 400
+    if not 1 <= days <= API_MAX_DAYS:
+        return jsonify(error=f'days must be between 1 and {API_MAX_DAYS}'), 400
+    if not (math.isfinite(kcal_limit) and kcal_limit > 0):
+        return jsonify(error='kcal_limit must be a positive number'), 400
+    if not all(math.isfinite(share) and 0 <= share <= 1 for share in shares):
+        return jsonify(error='The shares must be between 0 and 1'), 400
+    allergies = sorted(allergy for allergy in params.get('allergies', '').split(',') if allergy)
+    unknown = [allergy for allergy in allergies if allergy not in catalog.ALLERGENS]
+    if unknown:
+        return jsonify(error=f'Unknown allergies: {unknown}, known are {catalog.ALLERGENS}'), 400
+    limits = {
+        'kcal_limit': kcal_limit,
+        'carb_kcal_limit': kcal_limit * shares[0],
+        'protein_kcal_limit': kcal_limit * shares[1],
+        'fat_kcal_limit': kcal_limit * shares[2],
+        'allergies': allergies,
+        'low_salt': params.get('low_salt') in ['1', 'true'],
+    }
+
+    food_catalog = catalog.get_catalog()
+    key = plan_cache.get_plan_key(food_catalog.version, days, sorted(limits.items()), seed)
+    cached = api_cache.get(key)
+    if cached is None:
+        try:
+            cached = get_api_meal_plan(food_catalog, days, limits, seed)
+        except algorithm.MealPlanError as err:
+            return jsonify(error=str(err), violations=err.violations), 422
+        api_cache.put(key, cached)
+    etag, body, gzipped = cached
+
+    if 'gzip' in request.headers.get('Accept-Encoding', '') and len(body) >= API_MIN_GZIP_SIZE:
+        response = Response(gzipped, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+        etag = f'{etag}-gzip'
     else:
-        if low_salt:
-            path = "daily_meal_plans/pre_low_salt/*nutrients_low_salt.csv"
-        else:
-            path = "daily_meal_plans/pre/*nutrients.csv"
-    i = 1
-    for fname in glob.glob(path):
-        df = pd.read_csv(fname, sep=",")
-        df = df.set_index('Unnamed: 0')
-        df = df.T
-        if allergy and df['lactose'].iloc[-1] != 0:
-            continue # TODO: this causes a slight change of same food category on successive days
-                     # This can be fixed in the algorithm level
-        key = int(fname.split('/')[-1].split('_')[0])
-        nutrients_dict[key] = df.round(1).to_dict('list')
-        # nutrients_dict[df['sugar'].iloc[-1]] = df.round(1).to_dict('list')
-        i += 1
-    nutrients = convert_info_to_list_of_dicts(nutrients_dict, min_sugar, days)
-    return meal_plans, nutrients
+        response = Response(body, mimetype='application/json')
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
 
 @app.route('/feedback', methods=['GET', 'POST'])
 def feedback():
@@ -168,6 +238,18 @@ def feedback():
     return render_template('feedback.html')
 
 
+@app.route('/plan-cache/stats')
+def plan_cache_stats():
+    return jsonify(plan_cache.default_cache.get_stats())
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    text = metrics.render_prometheus(
+        metrics.default_metrics.get_stats(), plan_cache.default_cache.get_stats())
+    return Response(text, mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/calculate')
 def test():
     return render_template('index.html', test='Test ID is 123123123')
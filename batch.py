@@ -0,0 +1,94 @@
+import os
+import json
+import time
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import algorithm
+import catalog
+
+BATCH_DIR = 'daily_meal_plans/batch'
+
+def plan_profile(name, limits, days, output_dir,
+                 csv_path=catalog.SOURCE_CSV, cache_dir=catalog.CACHE_DIR, joint_week=False, seed=None):
+    """Plans one limits profile and saves its meal plans to output_dir/name"""
+    start = time.time()
+    # Mapped from the catalog cache once per worker process, so tasks carry only
+    # their limits and the catalog pages are shared by all the workers
+    food_catalog = catalog.get_catalog(csv_path, cache_dir)
+    directory = os.path.join(output_dir, name)
+    os.makedirs(directory, exist_ok=True)
+
+    if joint_week:
+        planner = algorithm.WeeklyMealPlanner(food_catalog, limits=limits)
+    else:
+        planner = algorithm.MultiDayMealPlanner(food_catalog, limits=limits, seed=seed)
+    total_nutrients = []
+    for day in planner.get_daily_meal_plans(days):
+        day.save_meal_plan_to_csv(directory)
+        day.save_total_nutrients_to_csv(directory)
+        total_nutrients.append(day.get_total_nutrients().to_dict())
+
+    return {
+        'name': name,
+        'limits': limits,
+        'seed': seed,
+        'directory': directory,
+        'total_nutrients': total_nutrients,
+        # The weeks that could not be planned jointly, planned day by day instead
+        'fallback_weeks': planner.fallback_weeks if joint_week else [],
+        'running_time': time.time() - start,
+    }
+
+
+def plan_profiles(profiles, days=7, workers=None, output_dir=BATCH_DIR,
+                  csv_path=catalog.SOURCE_CSV, cache_dir=catalog.CACHE_DIR):
+    """
+    Plans every profile (a limits dict with an optional 'name' and 'seed') in a pool of worker processes.
+    Returns the results in the order of the profiles and saves them to output_dir/results.json.
+    A profile that fails, e.g. with limits out of reach, gets an 'error' result and the others go on.
+    """
+    # Make sure the cache is built once here, not by every worker at the same time
+    catalog.get_catalog(csv_path, cache_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for i, profile in enumerate(profiles):
+            limits = {key: value for key, value in profile.items() if key not in ['name', 'seed']}
+            limits.setdefault('allergies', [''])
+            name = profile.get('name', f'profile_{i}')
+            futures.append((name, limits, profile.get('seed'), executor.submit(
+                plan_profile, name, limits, days, output_dir, csv_path, cache_dir, seed=profile.get('seed'))))
+        results = []
+        for name, limits, seed, future in futures:
+            try:
+                results.append(future.result())
+            except Exception as err:
+                logging.error(f'Planning the profile {name} failed: {err}')
+                # The limits out of reach, if the presolve found the plan infeasible
+                violations = getattr(err, 'violations', [])
+                results.append({'name': name, 'limits': limits, 'seed': seed,
+                                'error': str(err), 'violations': violations})
+    failed = sum('error' in result for result in results)
+    logging.info(f'Planned {len(profiles) - failed} of {len(profiles)} profiles in {time.time() - start:.1f}s')
+
+    with open(os.path.join(output_dir, 'results.json'), 'w') as f:
+        json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Plan meals for many limits profiles in parallel')
+    parser.add_argument('profiles', help='JSON file with a list of limits dicts, e.g. '
+                        '[{"name": "low_salt_2500", "kcal_limit": 2500, "low_salt": true}]')
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--workers', type=int, default=None, help='Defaults to the CPU count')
+    parser.add_argument('--output-dir', default=BATCH_DIR)
+    args = parser.parse_args()
+
+    with open(args.profiles) as f:
+        profiles = json.load(f)
+    plan_profiles(profiles, days=args.days, workers=args.workers, output_dir=args.output_dir)
@@ -0,0 +1,334 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+import data_import
+import metrics
+
+CACHE_DIR = 'catalog_cache'
+SOURCE_CSV = 'resultset.csv'
+
+# Numeric columns the algorithm needs. Stored as one (nutrient x food) float64 block
+# so that every nutrient row is contiguous and can be used directly as an LP row.
+NUTRIENT_COLUMNS = ['kcal', 'sugar', 'fibre', 'carb_kcal', 'protein_kcal', 'fat_kcal',
+                    'salt', 'sodium', 'lactose', 'alc']
+
+# Allergies a meal plan can exclude: lactose by the nutrient, the others by name
+ALLERGENS = ['lactose'] + list(data_import.ALLERGEN_PATTERNS)
+
+# The most (available) foods algorithm.WeeklyMealPlanner's MILP plans a week for in its time limit
+# (python -m tests.run_weekly_benchmark --sizes ...). Weeks over more foods are planned day by day.
+WEEKLY_MAX_FOODS = 1000
+
+
+class Catalog():
+    """
+    The cleaned food catalog in a compact, immutable form:
+    a nutrient matrix plus integer coded category and extra_category columns.
+
+    The nutrient matrix is memory-mapped from the cache directory, so the OS shares
+    the same pages between every gunicorn worker reading the same cache.
+    The optimizer works on row masks over the catalog and DataFrames are
+    materialized only for the foods of a meal plan, so any number of plans can share one catalog.
+
+    Candidate filtering uses indexes built with the catalog: the rows of every category
+    and extra_category, and a bitset of the foods that are not safe for each allergy.
+    """
+
+    def __init__(self, nutrients, index, names, category_codes, categories,
+                 extra_category_codes, extra_categories, version=None, allergens=None):
+        self.nutrients = nutrients
+        self.index = index
+        self.names = names
+        self.category_codes = category_codes
+        self.categories = categories
+        self.extra_category_codes = extra_category_codes
+        self.extra_categories = extra_categories
+        self.version = version
+        # (allergen x food / 8) packed bits, in the order of ALLERGENS
+        self.allergens = allergens if allergens is not None else get_allergen_bitsets(
+            names, nutrients[NUTRIENT_COLUMNS.index('lactose')])
+        for array in [nutrients, index, names, category_codes, categories,
+                      extra_category_codes, extra_categories, self.allergens]:
+            array.flags.writeable = False
+        self._labels = None
+
+        self.category_rows = _group_rows(category_codes, len(categories))
+        self.extra_category_rows = _group_rows(extra_category_codes, len(extra_categories))
+        self.category_lookup = {category: code for code, category in enumerate(categories)}
+        self.extra_category_lookup = {
+            extra_c: code for code, extra_c in enumerate(extra_categories) if extra_c != ''}
+
+    def __len__(self):
+        return len(self.index)
+
+    def get_nutrient(self, name):
+        """The values of one nutrient column, e.g. catalog.get_nutrient('lactose')"""
+        return self.nutrients[NUTRIENT_COLUMNS.index(name)]
+
+    def get_positions(self, labels):
+        """Row positions of the foods with the given index labels, -1 for unknown labels"""
+        if self._labels is None:
+            self._labels = pd.Index(self.index)
+        return self._labels.get_indexer(labels)
+
+    def get_category_rows(self, categories=(), extra_categories=()):
+        """Row positions of the foods in any of the categories or (non-empty) extra categories"""
+        return np.concatenate(
+            [_get_rows(self.category_rows, self.category_lookup, categories),
+             _get_rows(self.extra_category_rows, self.extra_category_lookup, extra_categories)])
+
+    def get_allergen_mask(self, allergies):
+        """Rows of the foods that are not safe for any of the allergies, an OR of their bitsets"""
+        unknown = set(allergies) - set(ALLERGENS)
+        if unknown:
+            raise ValueError(f'Unknown allergies: {sorted(unknown)}, known are {ALLERGENS}')
+        bits = np.bitwise_or.reduce(
+            self.allergens[[ALLERGENS.index(allergy) for allergy in allergies]], axis=0)
+        return np.unpackbits(bits, count=len(self)).astype(bool)
+
+    @classmethod
+    def from_dataframe(cls, df, version=None):
+        category_codes, categories = pd.factorize(df['category'])
+        extra_category_codes, extra_categories = pd.factorize(df['extra_category'])
+        nutrients = np.ascontiguousarray(
+            df[NUTRIENT_COLUMNS].to_numpy(dtype=np.float64).T)
+        return cls(
+            nutrients=nutrients,
+            index=df.index.to_numpy(),
+            names=df['name'].to_numpy(dtype=object),
+            category_codes=category_codes.astype(np.int32),
+            categories=np.asarray(categories, dtype=object),
+            extra_category_codes=extra_category_codes.astype(np.int32),
+            extra_categories=np.asarray(extra_categories, dtype=object),
+            version=version)
+
+    def to_dataframe(self, rows=None):
+        """The catalog, or only the given row positions of it, as a DataFrame of the cleaned foods"""
+        if rows is None:
+            rows = slice(None)
+        df = pd.DataFrame(self.nutrients[:, rows].T, index=self.index[rows],
+                          columns=NUTRIENT_COLUMNS, copy=False)
+        df.insert(0, 'name', self.names[rows])
+        df.insert(1, 'category', self.categories[self.category_codes[rows]])
+        df.insert(2, 'extra_category',
+                  self.extra_categories[self.extra_category_codes[rows]])
+        return df
+
+
+def _group_rows(codes, n_groups):
+    """The rows of every code: rows[offsets[code]:offsets[code + 1]]"""
+    rows = np.argsort(codes, kind='stable')
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=n_groups))])
+    return rows, offsets
+
+
+def _get_rows(group_rows, lookup, names):
+    rows, offsets = group_rows
+    codes = [lookup[name] for name in names if name in lookup]
+    return np.concatenate([rows[offsets[code]:offsets[code + 1]] for code in codes] + [rows[:0]])
+
+
+def get_allergen_bitsets(names, lactose):
+    masks = data_import.get_allergen_masks(names)
+    masks['lactose'] = np.asarray(lactose) > 0
+    return np.vstack([np.packbits(masks[allergen]) for allergen in ALLERGENS])
+
+
+def as_catalog(food_catalog):
+    """A Catalog as it is, or a DataFrame of cleaned foods (e.g. data_import.clean_data output) as a Catalog"""
+    if isinstance(food_catalog, Catalog):
+        return food_catalog
+    return Catalog.from_dataframe(food_catalog)
+
+
+def get_source_fingerprint(csv_path):
+    stat = os.stat(csv_path)
+    return {'mtime': stat.st_mtime, 'size': stat.st_size}
+
+
+def get_file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _save(path, write, mode='wb'):
+    # Write next to the target and rename, so concurrent readers never see half a file
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, mode) as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def build_catalog(csv_path=SOURCE_CSV, cache_dir=CACHE_DIR, chunksize=data_import.CHUNK_SIZE):
+    """
+    Runs the import pipeline once and writes the cleaned catalog to the cache directory.
+
+    The CSV is imported chunk by chunk and every nutrient of every chunk is appended to
+    its own file as soon as the chunk is clean. The files are then joined into the
+    (nutrient x food) nutrients.npy, so the memory use is bounded by the chunk size
+    and the names and categories of the catalog, not by the size of the CSV.
+    """
+    if not os.path.exists(csv_path):
+        import fetcher
+        print('Downloading the dataset...')
+        fetcher.Fetcher(csv_path=csv_path).fetch()
+    print(f'Building the food catalog cache from {csv_path}...')
+    os.makedirs(cache_dir, exist_ok=True)
+    column_paths = [os.path.join(cache_dir, f'{column}.{os.getpid()}.tmp') for column in NUTRIENT_COLUMNS]
+    index, names, categories, extra_categories = [], [], [], []
+    try:
+        with metrics.timer('csv_import') as stage:
+            column_files = [open(path, 'wb') for path in column_paths]
+            try:
+                for df in data_import.iter_data(csv_path, chunksize):
+                    df = data_import.clean_data(df)
+                    nutrients = df[NUTRIENT_COLUMNS].to_numpy(dtype=np.float64)
+                    for i, column_file in enumerate(column_files):
+                        column_file.write(np.ascontiguousarray(nutrients[:, i]).tobytes())
+                    index.append(df.index.to_numpy())
+                    names.append(df['name'].to_numpy(dtype=object))
+                    categories.append(df['category'].to_numpy(dtype=object))
+                    extra_categories.append(df['extra_category'].to_numpy(dtype=object))
+            finally:
+                for column_file in column_files:
+                    column_file.close()
+            if not index:
+                raise ValueError(f'No foods in {csv_path}')
+            index = np.concatenate(index)
+            stage['rows'] = len(index)
+
+        def write_nutrients(f):
+            np.lib.format.write_array_header_1_0(f, {
+                'descr': np.lib.format.dtype_to_descr(np.dtype(np.float64)),
+                'fortran_order': False,
+                'shape': (len(NUTRIENT_COLUMNS), len(index)),
+            })
+            for path in column_paths:
+                with open(path, 'rb') as column_file:
+                    shutil.copyfileobj(column_file, f)
+        _save(os.path.join(cache_dir, 'nutrients.npy'), write_nutrients)
+    finally:
+        for path in column_paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    category_codes, categories = pd.factorize(np.concatenate(categories))
+    extra_category_codes, extra_categories = pd.factorize(np.concatenate(extra_categories))
+    source = get_source_fingerprint(csv_path)
+    source['sha256'] = get_file_hash(csv_path)
+    catalog = Catalog(
+        nutrients=np.load(os.path.join(cache_dir, 'nutrients.npy'), mmap_mode='r'),
+        index=index,
+        names=np.concatenate(names),
+        category_codes=category_codes.astype(np.int32),
+        categories=np.asarray(categories, dtype=object),
+        extra_category_codes=extra_category_codes.astype(np.int32),
+        extra_categories=np.asarray(extra_categories, dtype=object),
+        version=source['sha256'][:16])
+
+    arrays = {
+        'category_codes': catalog.category_codes,
+        'extra_category_codes': catalog.extra_category_codes,
+        'allergens': catalog.allergens,
+    }
+    for name, array in arrays.items():
+        _save(os.path.join(cache_dir, f'{name}.npy'),
+              lambda f: np.save(f, array))
+    meta = {
+        'source': source,
+        'version': catalog.version,
+        'columns': NUTRIENT_COLUMNS,
+        'allergens': ALLERGENS,
+        'index': catalog.index.tolist(),
+        'names': catalog.names.tolist(),
+        'categories': catalog.categories.tolist(),
+        'extra_categories': catalog.extra_categories.tolist(),
+    }
+    # meta.json is written last: its presence marks a complete cache
+    _save(os.path.join(cache_dir, 'meta.json'),
+          lambda f: json.dump(meta, f), mode='w')
+    return catalog
+
+
+def _read_meta(cache_dir):
+    meta_path = os.path.join(cache_dir, 'meta.json')
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        return json.load(f)
+
+
+def is_cache_fresh(meta, csv_path=SOURCE_CSV, cache_dir=CACHE_DIR):
+    """
+    The cache is fresh when it was built from the current source CSV.
+
+    mtime and size are checked first because they are cheap. If they differ,
+    the file hash decides, so e.g. a re-downloaded but identical CSV does not trigger a rebuild.
+    """
+    if meta is None or meta.get('columns') != NUTRIENT_COLUMNS or meta.get('allergens') != ALLERGENS:
+        return False
+    if not os.path.exists(csv_path):
+        return True  # Nothing to compare against, the cache is all we have
+    fingerprint = get_source_fingerprint(csv_path)
+    source = meta['source']
+    if fingerprint['mtime'] == source['mtime'] and fingerprint['size'] == source['size']:
+        return True
+    if get_file_hash(csv_path) != source['sha256']:
+        return False
+    source.update(fingerprint)
+    _save(os.path.join(cache_dir, 'meta.json'),
+          lambda f: json.dump(meta, f), mode='w')
+    return True
+
+
+def load_catalog(csv_path=SOURCE_CSV, cache_dir=CACHE_DIR):
+    """Memory-maps the cached catalog, (re)building the cache first if it is missing or stale"""
+    def load(name):
+        return np.load(os.path.join(cache_dir, f'{name}.npy'), mmap_mode='r')
+
+    with metrics.timer('catalog_load', rebuilt=False) as stage:
+        meta = _read_meta(cache_dir)
+        if not is_cache_fresh(meta, csv_path, cache_dir):
+            build_catalog(csv_path, cache_dir)
+            meta = _read_meta(cache_dir)
+            stage['rebuilt'] = True
+
+        catalog = Catalog(
+            nutrients=load('nutrients'),
+            index=np.asarray(meta['index']),
+            names=np.asarray(meta['names'], dtype=object),
+            category_codes=load('category_codes'),
+            categories=np.asarray(meta['categories'], dtype=object),
+            extra_category_codes=load('extra_category_codes'),
+            extra_categories=np.asarray(meta['extra_categories'], dtype=object),
+            version=meta['version'],
+            allergens=load('allergens'))
+        stage['rows'] = len(catalog)
+    return catalog
+
+
+_catalog = None
+_catalog_source = None
+
+
+def get_catalog(csv_path=SOURCE_CSV, cache_dir=CACHE_DIR):
+    """
+    The process wide catalog. Loaded on first use and reloaded only
+    when the source CSV changes on disk.
+    """
+    global _catalog, _catalog_source
+    source = get_source_fingerprint(csv_path) if os.path.exists(csv_path) else None
+    if _catalog is None or source != _catalog_source:
+        _catalog = load_catalog(csv_path, cache_dir)
+        _catalog_source = source
+    return _catalog
+
+
+if __name__ == '__main__':
+    build_catalog()
@@ -1,35 +1,60 @@
 import os
+import logging
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-from pandas.api.types import is_string_dtype, is_numeric_dtype
-import requests
+from pandas.api.types import is_numeric_dtype
 import io
-import pandera as pa
+import metrics
 
+# requests and pandera are imported where they are used: the web app imports this module
+# for the catalog only, and its workers should not pay for loading them
 
-def get_data():
-    if not os.path.exists('resultset.csv'):
+
+FINELI_URL = 'https://fineli.fi/fineli/en/elintarvikkeet/resultset.csv'
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2228.0 Safari/537.3'}
+CHUNK_SIZE = 50000  # Foods per chunk of the streaming import
+
+
+def get_data(csv_path='resultset.csv', chunksize=CHUNK_SIZE):
+    if not os.path.exists(csv_path):
+        import fetcher
         print('Downloading the dataset...')
-        df = download_csv()
-        df.to_csv('resultset.csv', sep=";")
-    else:
-        df = pd.read_csv('resultset.csv', sep=";")
+        fetcher.Fetcher(csv_path=csv_path).fetch()
+    return pd.concat(iter_data(csv_path, chunksize))
+
+
+def iter_data(csv_path='resultset.csv', chunksize=CHUNK_SIZE):
+    """
+    The output of get_data chunk by chunk, so that the memory use of the import is
+    bounded by the chunk size instead of the file size.
+    Only the columns of get_columns() are read, and every chunk is validated on its own.
+    """
+    reader = pd.read_csv(csv_path, sep=";", usecols=get_columns(),
+                         dtype=get_column_dtypes(), chunksize=chunksize)
+    for df in reader:
         df = validate_original_csv_schema(df)
-    
-    wanted_columns = get_columns()
-    df = df[wanted_columns]
-    df = add_necessary_columns(df)
-    df = drop_unwanted_food(df)
-    return df
+        df = df[get_columns()]
+        df = add_necessary_columns(df)
+        yield drop_unwanted_food(df)
+
+
+def get_column_dtypes():
+    """
+    Explicit dtypes of the CSV columns. The nutrients are read as strings because
+    Fineli marks traces as '<0.1': without a dtype a chunk that has no traces
+    would be read as floats and fail the schema of the original CSV.
+    """
+    dtypes = {column: str for column in get_columns()}
+    dtypes['energy,calculated (kJ)'] = np.int64
+    return dtypes
 
 
 def download_csv():
-    url = 'https://fineli.fi/fineli/en/elintarvikkeet/resultset.csv'
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2228.0 Safari/537.3'}
-    response = requests.get(url, headers=headers)
+    import requests
+    import pandera as pa
+    url = FINELI_URL
+    response = requests.get(url, headers=HEADERS)
     file_object = io.StringIO(response.content.decode('utf-8'))
 
     df = pd.read_csv(file_object, sep=";")
@@ -48,6 +73,7 @@ def download_csv():
 
 
 def validate_original_csv_schema(df):
+    import pandera as pa
     schema_csv_download = pa.DataFrameSchema({
         'name': pa.Column(pa.String),
         'energy,calculated (kJ)': pa.Column(pa.Int, pa.Check(
@@ -63,7 +89,8 @@ def validate_original_csv_schema(df):
         'salt (mg)': pa.Column(pa.String),
         # 'lactose (g)': pa.Column(pa.String), # can have NaN values
     })
-    return schema_csv_download.validate(df)
+    with metrics.timer('schema_validation', rows=len(df), schema='original_csv'):
+        return schema_csv_download.validate(df)
 
 
 def drop_unwanted_food(df):
@@ -73,37 +100,105 @@ def drop_unwanted_food(df):
     return df[~df['category'].isin(unwanted_food)]
     
 
+def parse_numeric_columns(df, columns):
+    """
+    Parses the columns into one (food x column) float64 block without per-value Python code.
+
+    Fineli's strings ('12.3' and the estimate '<0.1') are converted with numpy's bulk
+    float conversion. Only a column that has other values goes through the slower
+    string operations of parse_text_values. Missing values and infs become 0.
+
+    Returns the block and the number of values per column that could not be parsed
+    (those are 0 in the block too).
+    """
+    values = np.empty((len(df), len(columns)), dtype=np.float64)
+    failures = {}
+    for i, column in enumerate(columns):
+        if is_numeric_dtype(df[column]):
+            values[:, i] = df[column].to_numpy(dtype=np.float64)
+            continue
+        raw = df[column].to_numpy(dtype=object)
+        estimates = raw == '<0.1'
+        try:
+            parsed = raw.copy()
+            # NOTE: the estimate <0.1 creates a distortion in the data. Hence, removed.
+            parsed[estimates] = 0.0
+            values[:, i] = parsed.astype(np.float64)
+        except (ValueError, TypeError):
+            values[:, i], failed = parse_text_values(raw)
+            if failed.any():
+                failures[column] = int(failed.sum())
+                logging.warning(f'{failures[column]} values of "{column}" could not be parsed, '
+                                f'e.g. {list(pd.unique(raw[failed])[:3])}')
+                metrics.increment('parse_failures_total', failures[column], column=column)
+
+    values[~np.isfinite(values)] = 0.0
+    return values, failures
+
+
+def parse_text_values(raw):
+    """
+    The values of an object array as floats, allowing surrounding spaces, comma decimals
+    ('1,5'), blanks and any estimate ('<5'). Blanks and estimates become 0.
+    Returns the floats and a mask of the values that could not be parsed, which are NaN.
+    """
+    raw = pd.Series(raw)
+    numbers = pd.to_numeric(raw, errors='coerce').to_numpy(dtype=np.float64)
+    retry = np.isnan(numbers) & raw.notna().to_numpy()
+    failed = np.zeros(len(raw), dtype=bool)
+    if retry.any():
+        text = raw[retry].astype(str).str.strip()
+        skipped = ((text == '') | text.str.startswith('<')).to_numpy()
+        fixed = pd.to_numeric(text.str.replace(',', '.', regex=False), errors='coerce').to_numpy()
+        fixed[skipped] = 0.0
+        numbers[retry] = fixed
+        failed[retry] = np.isnan(fixed)
+    return numbers, failed
+
+
 def clean_column(df, col_name):
-    if is_string_dtype(df[col_name]):
-        # NOTE: the estimate <0.1 creates a distortion in the data. Hence, removed.
-        col = pd.to_numeric(df[col_name].map(
-            lambda x: x if x != '<0.1' else 0.0))
-    else:
-        col = df[col_name]
-    return col.replace([np.inf, -np.inf], np.nan).fillna(0)
+    values, _ = parse_numeric_columns(df, [col_name])
+    return pd.Series(values[:, 0], index=df.index, name=col_name)
+
+
+NUMERIC_COLUMNS = [
+    'energy,calculated (kJ)',
+    'fat, total (g)',
+    'carbohydrate, available (g)',
+    'protein, total (g)',
+    'alcohol (g)',
+    'sugars, total (g)',
+    'fibre, total (g)',
+    'sodium (mg)',
+    'salt (mg)',
+    'lactose (g)',
+]
 
 
 def add_necessary_columns(df):
     df['category'], _ = df['name'].str.split(', ', 1).str
     df['extra_category'] = get_extra_category_list(df)
 
-    df['kcal'] = clean_column(
-        df, 'energy,calculated (kJ)') / 4.184  # kJ -> kcal
-    df['fat_kcal'] = clean_column(df, 'fat, total (g)') * 9
-    df['carb_kcal'] = clean_column(df, 'carbohydrate, available (g)') * 4
-    df['protein_kcal'] = clean_column(df, 'protein, total (g)') * 4
-    df['alc_kcal'] = clean_column(df, 'alcohol (g)') * 7
-    df['sugar'] = clean_column(df, 'sugars, total (g)')
-    df['fibre'] = clean_column(df, 'fibre, total (g)')
-    df['alc'] = clean_column(df, 'alcohol (g)')
-    df['sodium'] = clean_column(df, 'sodium (mg)')
-    df['salt'] = clean_column(df, 'salt (mg)')
-    df['lactose'] = clean_column(df, 'lactose (g)')
-    
+    with metrics.timer('numeric_parsing', rows=len(df)):
+        values, _ = parse_numeric_columns(df, NUMERIC_COLUMNS)
+    kj, fat, carb, protein, alcohol, sugar, fibre, sodium, salt, lactose = values.T
+
+    df['kcal'] = kj / 4.184  # kJ -> kcal
+    df['fat_kcal'] = fat * 9
+    df['carb_kcal'] = carb * 4
+    df['protein_kcal'] = protein * 4
+    df['alc_kcal'] = alcohol * 7
+    df['sugar'] = sugar
+    df['fibre'] = fibre
+    df['alc'] = alcohol
+    df['sodium'] = sodium
+    df['salt'] = salt
+    df['lactose'] = lactose
 
     df['kcal_ratio'] = (df['kcal'] / (df['fat_kcal'] +
                                       df['carb_kcal'] + df['protein_kcal'] + df['alc_kcal']))
 
+    import pandera as pa
     schema_added_columns = pa.DataFrameSchema({
         'category': pa.Column(pa.String),
         'extra_category': pa.Column(pa.String),
@@ -121,11 +216,16 @@ def add_necessary_columns(df):
         'lactose': pa.Column(pa.Float, pa.Check(lambda s: s >= 0)),
     })
 
-    validated_df = schema_added_columns.validate(df)
+    with metrics.timer('schema_validation', rows=len(df), schema='added_columns'):
+        validated_df = schema_added_columns.validate(df)
     return validated_df
 
 
-def get_extra_category_list(df):
+EXTRA_CATEGORIES = ['chicken', 'pork', 'beef', 'kebab', 'fish', 'cheese', 'shrimp', 'porridge',
+                    'lamb', 'tofu', 'salmon', 'hamburger', ' ham', 'ham ', 'pasta', 'cake', 'rice', 'protein']
+
+
+def get_extra_category_list(df, extra_categories=EXTRA_CATEGORIES):
     """
     These are more general categories to improve the variety of meal plans.
 
@@ -138,20 +238,41 @@ def get_extra_category_list(df):
 
     Due to these restrictions be careful on what you add here and in which order.
     """
-    extra_categories = ['chicken', 'pork', 'beef', 'kebab', 'fish', 'cheese', 'shrimp', 'porridge',
-                        'lamb', 'tofu', 'salmon', 'hamburger', ' ham', 'ham ', 'pasta', 'cake', 'rice', 'protein']
-    extra_category_list = []
+    names = df['name'].str.lower().reset_index(drop=True)
+    extra_category_values = np.full(len(names), '', dtype=object)
+
+    # One vectorized substring scan per extra category, in priority order.
+    # Matched names are dropped from the scan, so the first match wins.
+    for extra_c in extra_categories:
+        if names.empty:
+            break
+        matches = names.str.contains(extra_c, regex=False).to_numpy(dtype=bool)
+        extra_category_values[names.index[matches]] = extra_c
+        names = names[~matches]
+
+    return extra_category_values.tolist()
+
 
-    def get_extra_category_value(row):
-        for extra_c in extra_categories:
-            if extra_c in row['name'].lower():
-                return extra_c
-        return ''
+# Name patterns (regex, lower case) of the foods that are not safe for an allergy.
+# Fineli has no allergen data, so like the extra categories these are simple name matches.
+# A food matching by accident is only excluded unnecessarily, which is the safe direction.
+# Celiacs can eat every food not made of wheat, barley or rye, oats are fine (see get_columns).
+ALLERGEN_PATTERNS = {
+    'gluten': ['wheat', 'barley', 'rye', 'spelt', 'semolina', 'couscous', 'bulgur', 'malt', 'flour',
+               'bread', r'\bbuns?\b', r'\brolls?\b', 'pasta', 'macaroni', 'spaghetti', 'noodle', 'lasagne',
+               'pizza', r'\bpies?\b', 'pastry', 'cake', 'cookie', 'biscuit', 'cracker', 'muesli', 'beer'],
+    'nuts': [r'\bnuts?\b', 'almond', 'hazelnut', 'peanut', 'walnut', 'cashew', 'pistachio', 'pecan',
+             'macadamia', 'praline', 'marzipan', 'nougat'],
+}
 
-    for i, row in df.iterrows():
-        extra_category_list.append(get_extra_category_value(row))
 
-    return extra_category_list
+def get_allergen_masks(names, allergen_patterns=ALLERGEN_PATTERNS):
+    """Allergy -> bool array of the names matching any of its patterns"""
+    names = pd.Series(names, dtype=object).str.lower()
+    return {
+        allergy: names.str.contains('|'.join(patterns), regex=True).to_numpy(dtype=bool)
+        for allergy, patterns in allergen_patterns.items()
+    }
 
 
 def clean_data(df):
@@ -202,7 +323,8 @@ def get_columns():
         'vitamin B-12 (cobalamin) (µg)',  # NOTE: extra: vegetarian
         'vitamin D (µg)',  # NOTE: extra: winter time
     ]
-    # TODO: allergies # Keliaakikko voi syödä kaikkia ruokia, joiden valmistuksessa ei ole käytetty vehnää, ohraa ja ruista. Keliaakikolle sopivia viljoja ovat gluteenittomat viljat eli riisi, maissi, hirssi ja tattari. Lisäksi keliaakikot voivat käyttää kauraa.
-    # TODO: allergies # Pähkinä
+    # NOTE: allergies # Keliaakikko voi syödä kaikkia ruokia, joiden valmistuksessa ei ole käytetty vehnää, ohraa ja ruista. Keliaakikolle sopivia viljoja ovat gluteenittomat viljat eli riisi, maissi, hirssi ja tattari. Lisäksi keliaakikot voivat käyttää kauraa.
+    # NOTE: allergies # Pähkinä
+    # Gluten and nuts are matched by name, see ALLERGEN_PATTERNS
 
     return essentials
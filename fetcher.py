@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import shutil
+import logging
+import argparse
+import catalog
+import data_import
+import metrics
+
+SOURCE = os.environ.get('FINELI_SOURCE', data_import.FINELI_URL)
+SNAPSHOT_DIR = 'catalog_snapshots'  # Next to the CSV
+KEEP_SNAPSHOTS = 3
+BLOCK_SIZE = 1 << 20
+
+
+def _save_json(path, data):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+class Fetcher():
+    """
+    Keeps csv_path (resultset.csv) up to date with the Fineli dataset.
+
+    The source is an http(s) URL or the path of a local mirror (also as file://...),
+    by default FINELI_SOURCE from the environment or Fineli's own URL.
+    - Refreshes are conditional: with the ETag and Last-Modified of the previous download
+      (or the mirror's size and mtime) an unchanged dataset is not transferred again.
+    - Downloads are streamed to disk and an interrupted download is resumed with a Range request.
+    - Every new dataset is checked (the header, the expected sha256 if known) and kept as an
+      immutable snapshot snapshot_dir/<version>.csv. The version is the start of its sha256,
+      the same version the catalog cache and so the plan cache are keyed on.
+    - If the source can not be reached, the current csv_path is used (offline).
+
+    The current snapshot and its validators are in snapshot_dir/current.json.
+    """
+
+    def __init__(self, source=SOURCE, csv_path=catalog.SOURCE_CSV, snapshot_dir=None,
+                 sha256=None, keep=KEEP_SNAPSHOTS, timeout=60):
+        self.source = source
+        self.csv_path = csv_path
+        if snapshot_dir is None:
+            snapshot_dir = os.path.join(os.path.dirname(csv_path), SNAPSHOT_DIR)
+        self.snapshot_dir = snapshot_dir
+        self.sha256 = sha256  # Expected checksum of the dataset, if published
+        self.keep = keep
+        self.timeout = timeout
+        self.state_path = os.path.join(snapshot_dir, 'current.json')
+        self.part_path = os.path.join(snapshot_dir, 'download.part')
+
+    def is_http(self):
+        return self.source.startswith(('http://', 'https://'))
+
+    def get_mirror_path(self):
+        return self.source[len('file://'):] if self.source.startswith('file://') else self.source
+
+    def get_state(self):
+        """The current snapshot: version, sha256, size, source, validators and fetched_at"""
+        return _read_json(self.state_path)
+
+    def fetch(self, force=False):
+        """
+        Brings csv_path up to date with the source. Returns the state of the current
+        snapshot, with 'status' 'downloaded', 'not_modified' or 'offline'.
+        force skips the conditional refresh and transfers the dataset again.
+        """
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        state = self.get_state()
+        if force or state.get('source') != self.source or not os.path.exists(self.csv_path):
+            validators = {}
+        else:
+            validators = state.get('validators', {})
+
+        with metrics.timer('csv_fetch', source='http' if self.is_http() else 'mirror') as stage:
+            try:
+                if self.is_http():
+                    validators = self.download(validators)
+                else:
+                    validators = self.copy_mirror(validators)
+            except OSError as err:  # Also the requests exceptions
+                if not os.path.exists(self.csv_path):
+                    raise
+                logging.warning(f'Could not fetch {self.source}, using the current {self.csv_path}: {err}')
+                status = 'offline'
+            else:
+                if validators is None:
+                    status = 'not_modified'
+                else:
+                    state = self.store(validators)
+                    status = 'downloaded'
+            stage['status'] = status
+        metrics.increment('csv_fetches_total', status=status)
+        return dict(state, status=status)
+
+    def download(self, validators):
+        """Streams the source to the part file. Returns the new validators, or None if not modified."""
+        import requests
+        headers = dict(data_import.HEADERS)
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+
+        # Resume an interrupted download of the same version of the dataset
+        part = _read_json(f'{self.part_path}.json')
+        offset = os.path.getsize(self.part_path) if os.path.exists(self.part_path) else 0
+        if offset and part.get('source') == self.source and (part.get('etag') or part.get('last_modified')):
+            headers['Range'] = f'bytes={offset}-'
+            headers['If-Range'] = part.get('etag') or part['last_modified']
+
+        with requests.get(self.source, headers=headers, stream=True, timeout=self.timeout) as response:
+            if response.status_code == 304:
+                return None
+            response.raise_for_status()
+            new_validators = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+            }
+            resumed = response.status_code == 206
+            if not resumed:
+                offset = 0
+                _save_json(f'{self.part_path}.json', dict(new_validators, source=self.source))
+            expected_size = None
+            if 'Content-Length' in response.headers and 'Content-Encoding' not in response.headers:
+                expected_size = offset + int(response.headers['Content-Length'])
+            with open(self.part_path, 'ab' if resumed else 'wb') as f:
+                for block in response.iter_content(chunk_size=BLOCK_SIZE):
+                    f.write(block)
+        if expected_size is not None and os.path.getsize(self.part_path) != expected_size:
+            raise IOError(f'Incomplete download of {self.source}: {os.path.getsize(self.part_path)} '
+                          f'of {expected_size} bytes, run again to resume')
+        if resumed:
+            logging.info(f'Resumed the download of {self.source} from byte {offset}')
+        return new_validators
+
+    def copy_mirror(self, validators):
+        """Copies the mirror's file to the part file. Returns the new validators, or None if not modified."""
+        path = self.get_mirror_path()
+        stat = os.stat(path)
+        new_validators = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        if validators == new_validators:
+            return None
+        shutil.copyfile(path, self.part_path)
+        if self.sha256 is None and os.path.exists(f'{path}.sha256'):
+            with open(f'{path}.sha256') as f:
+                self.sha256 = f.read().split()[0]
+        return new_validators
+
+    def check(self, path):
+        """The sha256 of the downloaded dataset, after checking that it is the dataset and intact"""
+        with open(path, encoding='utf-8', errors='replace') as f:
+            header = f.readline().rstrip('\r\n').split(';')
+        missing = [column for column in data_import.get_columns() if column not in header]
+        if missing:
+            raise ValueError(f'{self.source} is not the Fineli dataset, missing columns: {missing}')
+        sha256 = catalog.get_file_hash(path)
+        if self.sha256 is not None and sha256 != self.sha256:
+            raise ValueError(f'Checksum mismatch of {self.source}: {sha256}, expected {self.sha256}')
+        return sha256
+
+    def store(self, validators):
+        """Keeps the downloaded dataset as a snapshot and makes it the current csv_path"""
+        try:
+            sha256 = self.check(self.part_path)
+        finally:
+            if os.path.exists(f'{self.part_path}.json'):
+                os.remove(f'{self.part_path}.json')
+        version = sha256[:16]
+        snapshot_path = os.path.join(self.snapshot_dir, f'{version}.csv')
+        os.replace(self.part_path, snapshot_path)
+
+        if not os.path.exists(self.csv_path) or catalog.get_file_hash(self.csv_path) != sha256:
+            tmp_path = f'{self.csv_path}.{os.getpid()}.tmp'
+            shutil.copyfile(snapshot_path, tmp_path)
+            os.replace(tmp_path, self.csv_path)
+
+        previous = self.get_state()
+        history = [version] + [v for v in previous.get('history', []) if v != version]
+        for old_version in history[self.keep:]:
+            old_path = os.path.join(self.snapshot_dir, f'{old_version}.csv')
+            if os.path.exists(old_path):
+                os.remove(old_path)
+        state = {
+            'version': version,
+            'sha256': sha256,
+            'size': os.path.getsize(snapshot_path),
+            'source': self.source,
+            'validators': validators,
+            'fetched_at': time.time(),
+            'history': history[:self.keep],
+        }
+        _save_json(self.state_path, state)
+        logging.info(f'Fetched version {version} of the dataset from {self.source}')
+        return state
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Fetch the Fineli dataset to resultset.csv')
+    parser.add_argument('--source', default=SOURCE, help='URL or the path of a local mirror')
+    parser.add_argument('--sha256', help='Expected checksum of the dataset')
+    parser.add_argument('--force', action='store_true', help='Download even if not modified')
+    parser.add_argument('--status', action='store_true', help='Only print the current snapshot')
+    args = parser.parse_args()
+
+    fetcher = Fetcher(source=args.source, sha256=args.sha256)
+    state = fetcher.get_state() if args.status else fetcher.fetch(force=args.force)
+    print(json.dumps({key: value for key, value in state.items() if key != 'history'}, indent=2))
@@ -0,0 +1,204 @@
+import os
+import re
+import shutil
+import json
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import catalog
+import metrics
+import plan_store
+
+JOBS_DIR = 'daily_meal_plans/jobs'
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+JOB_RETENTION = 24 * 3600  # seconds a finished job's meal plans are kept
+# The (allergy, low_salt) variants the meal plan page toggles between
+VARIANTS = [('', False), ('', True), ('lactose', False), ('lactose', True)]
+SIBLING_NICE = 10  # The sibling variants run at a lower CPU priority than the requested ones
+MAX_PENDING_SIBLINGS = 2 * (len(VARIANTS) - 1)  # No more siblings are queued while this many wait or run
+
+
+def get_job_dir(job_id, jobs_dir=JOBS_DIR):
+    if not JOB_ID_PATTERN.match(job_id):
+        raise ValueError(f'Invalid job id: {job_id}')
+    return os.path.join(jobs_dir, job_id)
+
+
+def write_status(job_dir, status, info):
+    info = dict(info, status=status, updated_at=time.time())
+    tmp_path = os.path.join(job_dir, f'status.json.{os.getpid()}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(info, f)
+    os.replace(tmp_path, os.path.join(job_dir, 'status.json'))
+
+
+def read_status(job_id, jobs_dir=JOBS_DIR):
+    """The job's status dict, or None for an unknown job"""
+    try:
+        with open(os.path.join(get_job_dir(job_id, jobs_dir), 'status.json')) as f:
+            return json.load(f)
+    except (ValueError, FileNotFoundError):
+        return None
+
+
+def run_job(job_id, days, limits, joint_week, jobs_dir=JOBS_DIR, nice=0):
+    """
+    Runs in a worker process. The meal plans are saved to the job's own
+    directory in the same layout as daily_meal_plans/new(_low_salt).
+    With nice the worker process runs at least that much below the normal CPU priority.
+    Returns the job's stage metrics for the web process to merge.
+    """
+    import batch  # Loads the solver stack in the worker process only, not in the web workers
+    if nice and hasattr(os, 'nice'):
+        os.nice(max(0, nice - os.nice(0)))  # os.nice adds up, and the worker process is reused
+    metrics.default_metrics.clear()  # The worker process is reused, count only this job
+    job_dir = get_job_dir(job_id, jobs_dir)
+    status = read_status(job_id, jobs_dir)
+    write_status(job_dir, 'running', status)
+    variant = 'new_low_salt' if limits.get('low_salt') else 'new'
+    try:
+        result = batch.plan_profile(variant, limits, days, job_dir, joint_week=joint_week)
+    except Exception as err:
+        logging.exception(f'Meal plan job {job_id} failed')
+        # The limits out of reach, if the presolve found the plan infeasible
+        violations = getattr(err, 'violations', [])
+        write_status(job_dir, 'failed', dict(status, error=str(err), violations=violations))
+        metrics.increment('jobs_total', status='failed')
+        return metrics.default_metrics.get_stats()
+    write_status(job_dir, 'done', dict(status, running_time=result['running_time'],
+                                       fallback_weeks=result['fallback_weeks']))
+    metrics.increment('jobs_total', status='done')
+    return metrics.default_metrics.get_stats()
+
+
+def merge_job_metrics(future):
+    if not future.cancelled() and future.exception() is None:
+        metrics.default_metrics.merge(future.result())
+
+
+class JobQueue():
+    """
+    Runs the meal plan optimizations in a pool of background processes, so the
+    web workers only enqueue a job and poll its status.
+
+    The sibling variants nobody has asked for yet run in a pool of their own, at a
+    lower CPU priority, so they never delay a requested job. While that pool is backed
+    up with MAX_PENDING_SIBLINGS jobs, no more siblings are queued.
+
+    The job status and results are files in the job's directory, so any web worker
+    process can answer for a job, not only the one that submitted it.
+    """
+
+    def __init__(self, max_workers=2, sibling_workers=1, jobs_dir=JOBS_DIR, retention=JOB_RETENTION):
+        self.max_workers = max_workers
+        self.sibling_workers = sibling_workers
+        self.jobs_dir = jobs_dir
+        self.retention = retention
+        self.sibling_nice = SIBLING_NICE
+        self.executor = None
+        self.sibling_executor = None
+        self.pending_siblings = 0
+        self.lock = threading.Lock()
+
+    def get_executor(self):
+        # Created on first use so that the pool is started in the web worker process, after the fork
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self.executor
+
+    def get_sibling_executor(self):
+        with self.lock:
+            if self.sibling_executor is None:
+                self.sibling_executor = ProcessPoolExecutor(max_workers=self.sibling_workers)
+            return self.sibling_executor
+
+    def reserve_siblings(self, count):
+        """Whether count more siblings fit in the sibling pool's backlog, counting them in if so"""
+        with self.lock:
+            if self.pending_siblings + count > MAX_PENDING_SIBLINGS:
+                return False
+            self.pending_siblings += count
+            return True
+
+    def release_sibling(self, future):
+        with self.lock:
+            self.pending_siblings -= 1
+
+    def submit(self, days, allergy, low_salt, joint_week=False, siblings=True):
+        """
+        Queues the job of the variant and, with siblings, a job for each of the other VARIANTS,
+        so that toggling low salt or the allergy finds its meal plans already calculated.
+        The siblings are skipped if the sibling pool is backed up. Returns the requested job's id.
+        """
+        self.prune()
+        variants = [(allergy, low_salt)]
+        sibling_variants = [variant for variant in VARIANTS if variant != (allergy, low_salt)]
+        siblings = siblings and self.reserve_siblings(len(sibling_variants))
+        if siblings:
+            variants += sibling_variants
+        job_ids = [uuid.uuid4().hex for _ in variants]
+        group = [{'allergy': variant_allergy, 'low_salt': variant_low_salt, 'job_id': job_id}
+                 for (variant_allergy, variant_low_salt), job_id in zip(variants, job_ids)]
+        if siblings:
+            catalog.get_catalog()  # Make sure the cache is built once here, not by the concurrent jobs
+        # All the statuses are written before the first job runs, so every job knows its siblings
+        for (variant_allergy, variant_low_salt), job_id in zip(variants, job_ids):
+            job_dir = get_job_dir(job_id, self.jobs_dir)
+            os.makedirs(job_dir)
+            write_status(job_dir, 'queued', {
+                'days': days, 'allergy': variant_allergy, 'low_salt': variant_low_salt,
+                'joint_week': joint_week, 'variants': group, 'submitted_at': time.time()})
+        for i, ((variant_allergy, variant_low_salt), job_id) in enumerate(zip(variants, job_ids)):
+            limits = {'allergies': [variant_allergy], 'low_salt': variant_low_salt}
+            if i == 0:
+                future = self.get_executor().submit(run_job, job_id, days, limits, joint_week, self.jobs_dir)
+            else:
+                future = self.get_sibling_executor().submit(
+                    run_job, job_id, days, limits, joint_week, self.jobs_dir, self.sibling_nice)
+                future.add_done_callback(self.release_sibling)
+            future.add_done_callback(merge_job_metrics)
+        return job_ids[0]
+
+    def prune(self):
+        """Deletes the directories of the jobs that finished more than retention seconds ago"""
+        if not os.path.isdir(self.jobs_dir):
+            return
+        expired = time.time() - self.retention
+        pruned = 0
+        for job_id in os.listdir(self.jobs_dir):
+            status = read_status(job_id, self.jobs_dir)
+            if status is not None and status['status'] in ['done', 'failed'] and status['updated_at'] < expired:
+                shutil.rmtree(get_job_dir(job_id, self.jobs_dir), ignore_errors=True)
+                pruned += 1
+        if pruned:
+            metrics.increment('jobs_pruned_total', pruned)
+            logging.info(f'Pruned {pruned} finished meal plan jobs')
+
+    def get_sibling(self, job_id, days, allergy, low_salt, joint_week=False):
+        """
+        The id of the job of the other variant submitted together with the job, for the same
+        days and joint_week. None if there is no such job or it failed.
+        """
+        status = self.get_status(job_id)
+        if status is None or (status['days'], status['joint_week']) != (days, joint_week):
+            return None
+        for variant in status.get('variants', []):
+            if (variant['allergy'], variant['low_salt']) != (allergy, low_salt) or variant['job_id'] == job_id:
+                continue
+            sibling_status = self.get_status(variant['job_id'])
+            if sibling_status is not None and sibling_status['status'] != 'failed':
+                return variant['job_id']
+        return None
+
+    def get_status(self, job_id):
+        return read_status(job_id, self.jobs_dir)
+
+    def get_nutrients_and_meal_plans(self, job_id):
+        """The finished job's meal plans and nutrients as the template expects them"""
+        status = self.get_status(job_id)
+        store = plan_store.PlanStore(get_job_dir(job_id, self.jobs_dir))
+        return store.get_nutrients_and_meal_plans(
+            status['days'], allergy=status['allergy'], low_salt=status['low_salt'], new_meal_plan=True)
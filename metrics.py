@@ -0,0 +1,141 @@
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger('meal_planner.metrics')
+
+PREFIX = 'meal_planner'
+
+
+class Metrics():
+    """
+    Durations and row counts of the planning pipeline's stages, plus plain counters
+    (e.g. LP solves by status). Every finished stage is also logged as one JSON line.
+
+    The numbers are per process. Thread safe, as gunicorn serves the app with several threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}  # stage -> {'count', 'seconds', 'max_seconds', 'rows'}
+        self.counters = {}  # (name, ((label, value), ...)) -> value
+
+    def record(self, stage, seconds, rows=None, **info):
+        with self.lock:
+            totals = self.stages.setdefault(
+                stage, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'rows': 0})
+            totals['count'] += 1
+            totals['seconds'] += seconds
+            totals['max_seconds'] = max(totals['max_seconds'], seconds)
+            totals['rows'] += rows or 0
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(dict(stage=stage, seconds=round(seconds, 6), rows=rows, **info)))
+
+    @contextmanager
+    def timer(self, stage, rows=None, **info):
+        """
+        Times the block as the stage. The yielded dict can be updated inside the block,
+        e.g. with the number of rows that are known only at the end:
+
+            with metrics.timer('post_processing') as info:
+                ...
+                info['rows'] = len(df)
+
+        A stage that raises is recorded too, with the exception's class as the error label,
+        and counted in stage_errors_total.
+        """
+        info = dict(info, rows=rows)
+        start = time.perf_counter()
+        try:
+            yield info
+        except Exception as err:
+            info['error'] = type(err).__name__
+            self.increment('stage_errors_total', stage=stage, error=info['error'])
+            raise
+        finally:
+            self.record(stage, time.perf_counter() - start, **info)
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'stages': {stage: dict(totals) for stage, totals in self.stages.items()},
+                'counters': [[name, dict(labels), value] for (name, labels), value in self.counters.items()],
+            }
+
+    def merge(self, stats):
+        """Adds the get_stats() of another process, e.g. of a background job"""
+        with self.lock:
+            for stage, other in stats['stages'].items():
+                totals = self.stages.setdefault(
+                    stage, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'rows': 0})
+                totals['count'] += other['count']
+                totals['seconds'] += other['seconds']
+                totals['max_seconds'] = max(totals['max_seconds'], other['max_seconds'])
+                totals['rows'] += other['rows']
+            for name, labels, value in stats['counters']:
+                key = (name, tuple(sorted(labels.items())))
+                self.counters[key] = self.counters.get(key, 0) + value
+
+    def clear(self):
+        with self.lock:
+            self.stages.clear()
+            self.counters.clear()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    values = ','.join(f'{name}="{str(value)}"' for name, value in sorted(labels.items()))
+    return '{' + values + '}'
+
+
+def render_prometheus(stats, plan_cache_stats=None):
+    """The stats of Metrics.get_stats() (and PlanCache.get_stats()) in the Prometheus text format"""
+    lines = [
+        f'# HELP {PREFIX}_stage_seconds Time spent in each stage of the planning pipeline',
+        f'# TYPE {PREFIX}_stage_seconds summary',
+    ]
+    for stage, totals in sorted(stats['stages'].items()):
+        lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {totals["count"]}')
+        lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {totals["seconds"]:.6f}')
+    lines += [
+        f'# HELP {PREFIX}_stage_max_seconds Slowest run of each stage',
+        f'# TYPE {PREFIX}_stage_max_seconds gauge',
+    ]
+    for stage, totals in sorted(stats['stages'].items()):
+        lines.append(f'{PREFIX}_stage_max_seconds{{stage="{stage}"}} {totals["max_seconds"]:.6f}')
+    lines += [
+        f'# HELP {PREFIX}_stage_rows_total Rows (foods) processed by each stage',
+        f'# TYPE {PREFIX}_stage_rows_total counter',
+    ]
+    for stage, totals in sorted(stats['stages'].items()):
+        lines.append(f'{PREFIX}_stage_rows_total{{stage="{stage}"}} {totals["rows"]}')
+
+    typed = set()
+    for name, labels, value in sorted(stats['counters'], key=lambda counter: counter[0]):
+        if name not in typed:
+            lines.append(f'# TYPE {PREFIX}_{name} counter')
+            typed.add(name)
+        lines.append(f'{PREFIX}_{name}{_format_labels(labels)} {value}')
+
+    if plan_cache_stats is not None:
+        for name in ['hits', 'disk_hits', 'misses', 'evictions']:
+            lines.append(f'# TYPE {PREFIX}_plan_cache_{name}_total counter')
+            lines.append(f'{PREFIX}_plan_cache_{name}_total {plan_cache_stats[name]}')
+        for name in ['size', 'max_size']:
+            lines.append(f'# TYPE {PREFIX}_plan_cache_{name} gauge')
+            lines.append(f'{PREFIX}_plan_cache_{name} {plan_cache_stats[name]}')
+    return '\n'.join(lines) + '\n'
+
+
+default_metrics = Metrics()
+timer = default_metrics.timer
+record = default_metrics.record
+increment = default_metrics.increment
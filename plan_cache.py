@@ -0,0 +1,99 @@
+import os
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def get_plan_key(*parts):
+    """
+    Content address of a daily LP: the hash of everything the solution depends on,
+    e.g. the model (catalog) version, the normalized limits, the food bounds and the method.
+    Numpy arrays are hashed by their bytes.
+    """
+    sha = hashlib.sha256()
+    for part in parts:
+        data = part.tobytes() if hasattr(part, 'tobytes') else repr(part).encode()
+        sha.update(len(data).to_bytes(8, 'little'))
+        sha.update(data)
+    return sha.hexdigest()
+
+
+class PlanCache():
+    """
+    LRU cache of LP solutions with a bounded number of entries in memory
+    and an optional, unbounded tier on disk (one pickle per key).
+    Thread safe, as gunicorn serves the app with several threads.
+    """
+
+    def __init__(self, max_size=256, directory=None):
+        self.max_size = max_size
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _get_disk_path(self, key):
+        return os.path.join(self.directory, f'{key}.pkl')
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+
+        if self.directory is not None and os.path.exists(self._get_disk_path(key)):
+            with open(self._get_disk_path(key), 'rb') as f:
+                value = pickle.load(f)
+            with self.lock:
+                self.disk_hits += 1
+            self._put_in_memory(key, value)
+            return value
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self._put_in_memory(key, value)
+        if self.directory is not None:
+            tmp_path = f'{self._get_disk_path(key)}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(value, f)
+            os.replace(tmp_path, self._get_disk_path(key))
+
+    def _put_in_memory(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+# The cache DailyMealPlan uses unless it is given another one
+default_cache = PlanCache()
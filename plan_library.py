@@ -0,0 +1,272 @@
+import os
+import json
+import time
+import logging
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import algorithm
+import catalog
+
+LIBRARY_PATH = 'daily_meal_plans/plan_library.npz'
+LIBRARY_DAYS = 7
+SEED = 0  # The library holds the plans of this seed, as the API plans by default
+
+# The profile grid: kcal targets, (carb, protein, fat) shares of the kcal,
+# the allergy combinations and low salt or not
+KCAL_LIMITS = [1500, 1750, 2000, 2250, 2500, 2750, 3000]
+MACRO_SPLITS = [(0.5, 0.3, 0.2), (0.45, 0.25, 0.3), (0.4, 0.3, 0.3), (0.3, 0.35, 0.35)]
+ALLERGY_SETS = [allergies for n in range(len(catalog.ALLERGENS) + 1)
+                for allergies in itertools.combinations(sorted(catalog.ALLERGENS), n)]
+
+MAX_RESCALE = 0.1  # At most +-10% of the grams, which covers the kcal grid between its points
+SPLIT_TOLERANCE = 0.02  # Largest difference of a macro share to the nearest precomputed split
+# Limits a request may not set to be served from the library, as its plans are solved for their defaults
+FIXED_LIMITS = ['fibre_limit', 'salt_limit', 'sodium_limit', 'food_limit']
+
+
+def get_profile_limits(kcal_limit, split, allergies, low_salt):
+    carb, protein, fat = split
+    return {
+        'kcal_limit': kcal_limit,
+        'carb_kcal_limit': kcal_limit * carb,
+        'protein_kcal_limit': kcal_limit * protein,
+        'fat_kcal_limit': kcal_limit * fat,
+        'allergies': list(allergies),
+        'low_salt': low_salt,
+    }
+
+
+def get_split(limits):
+    """The (carb, protein, fat) shares of the limits, with DailyMealPlan's defaults"""
+    kcal_limit = limits.get('kcal_limit') or 2000
+    return (
+        (limits.get('carb_kcal_limit') or kcal_limit * 0.5) / kcal_limit,
+        (limits.get('protein_kcal_limit') or kcal_limit * 0.3) / kcal_limit,
+        (limits.get('fat_kcal_limit') or kcal_limit * 0.2) / kcal_limit,
+    )
+
+
+def plan_grid_point(limits, days, csv_path=catalog.SOURCE_CSV, cache_dir=catalog.CACHE_DIR):
+    """
+    The (rows, 100g portions) of the foods of every day, or None if the profile has no plan.
+
+    The fibre limit is usually binding, and so are the salt limit of a low salt plan and
+    the grams of some foods. The plans are solved with a margin to these, by which they
+    can be rescaled by MAX_RESCALE.
+    """
+    food_catalog = catalog.get_catalog(csv_path, cache_dir)
+    defaults = algorithm.DailyMealPlan(food_catalog, limits=dict(limits, low_salt=True), cache=None)
+    limits = dict(limits, fibre_limit=defaults.fibre_limit / (1 - MAX_RESCALE),
+                  food_limit=defaults.food_limit / (1 + MAX_RESCALE))
+    if limits['low_salt']:
+        limits['salt_limit'] = defaults.salt_limit / (1 + MAX_RESCALE)
+        limits['sodium_limit'] = defaults.sodium_limit / (1 + MAX_RESCALE)
+    planner = algorithm.MultiDayMealPlanner(food_catalog, limits=limits, seed=SEED)
+    plans = []
+    try:
+        for day in planner.get_daily_meal_plans(days):
+            x = day.solution.x
+            rows = np.nonzero(x > 1e-9)[0]
+            plans.append((rows, x[rows]))
+    except algorithm.MealPlanError as err:
+        logging.warning(f'No plans for {limits}: {err}')
+        return None
+    return plans
+
+
+class PlanLibrary():
+    """
+    Meal plans precomputed over a grid of profiles, for answering the common
+    requests without a solve.
+
+    The plans of all the profiles are stored as one flat array of food rows and
+    one of their portions, indexed by the offsets of every (profile, day).
+    A request is matched to the profiles with the same allergies and low salt flag,
+    the nearest macro split and the nearest kcal target, and the portions are
+    rescaled to the requested kcal. The library is only valid for the catalog
+    version it was built from.
+    """
+
+    def __init__(self, version, days, kcal_limits, splits, allergies, low_salt, rows, portions, offsets):
+        self.version = version
+        self.days = days
+        self.kcal_limits = np.asarray(kcal_limits, dtype=np.float64)
+        self.splits = np.asarray(splits, dtype=np.float64)
+        self.allergies = list(allergies)  # A ','.join of the sorted allergies per profile
+        self.low_salt = np.asarray(low_salt, dtype=bool)
+        self.rows = np.asarray(rows, dtype=np.int32)
+        self.portions = np.asarray(portions, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)  # (profile x days + 1) of rows
+        # (allergies, low_salt) -> {split: (sorted kcal targets, their profiles)}
+        self.index = {}
+        for profile in range(len(self.kcal_limits)):
+            key = (self.allergies[profile], bool(self.low_salt[profile]))
+            split = tuple(self.splits[profile])
+            targets = self.index.setdefault(key, {}).setdefault(split, ([], []))
+            targets[0].append(self.kcal_limits[profile])
+            targets[1].append(profile)
+        for splits in self.index.values():
+            for split, (kcal_limits, profiles) in splits.items():
+                order = np.argsort(kcal_limits)
+                splits[split] = (np.asarray(kcal_limits)[order], np.asarray(profiles)[order])
+
+    def __len__(self):
+        return len(self.kcal_limits)
+
+    @classmethod
+    def build(cls, days=LIBRARY_DAYS, workers=None, csv_path=catalog.SOURCE_CSV, cache_dir=catalog.CACHE_DIR,
+              kcal_limits=KCAL_LIMITS, splits=MACRO_SPLITS, allergy_sets=ALLERGY_SETS):
+        """Plans every profile of the grid in a pool of worker processes"""
+        food_catalog = catalog.get_catalog(csv_path, cache_dir)  # Built once here, not by every worker
+        grid = list(itertools.product(kcal_limits, splits, allergy_sets, [False, True]))
+        start = time.time()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(plan_grid_point, get_profile_limits(*profile), days, csv_path, cache_dir)
+                       for profile in grid]
+            plans = []
+            for profile, future in zip(grid, futures):
+                try:
+                    plans.append(future.result())
+                except Exception:
+                    # Left out of the library, so requests for it fall back to the optimizer
+                    logging.exception(f'Planning the profile {profile} failed')
+                    plans.append(None)
+        logging.info(f'Planned {sum(plan is not None for plan in plans)} of {len(grid)} profiles '
+                     f'in {time.time() - start:.1f}s')
+
+        grid = [profile for profile, plan in zip(grid, plans) if plan is not None]
+        plans = [day for plan in plans if plan is not None for day in plan]
+        return cls(
+            version=food_catalog.version,
+            days=days,
+            kcal_limits=[profile[0] for profile in grid],
+            splits=np.array([profile[1] for profile in grid]).reshape(-1, 3),
+            allergies=[','.join(profile[2]) for profile in grid],
+            low_salt=[profile[3] for profile in grid],
+            rows=np.concatenate([rows for rows, _ in plans]) if plans else [],
+            portions=np.concatenate([portions for _, portions in plans]) if plans else [],
+            offsets=np.concatenate([[0], np.cumsum([len(rows) for rows, _ in plans])]))
+
+    def save(self, path=LIBRARY_PATH):
+        meta = {'version': self.version, 'days': self.days, 'allergies': self.allergies}
+        tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+        np.savez(tmp_path, meta=np.array(json.dumps(meta)), kcal_limits=self.kcal_limits,
+                 splits=self.splits, low_salt=self.low_salt, rows=self.rows,
+                 portions=self.portions, offsets=self.offsets)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=LIBRARY_PATH):
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            return cls(meta['version'], meta['days'], data['kcal_limits'], data['splits'],
+                       meta['allergies'], data['low_salt'], data['rows'], data['portions'], data['offsets'])
+
+    def lookup(self, limits):
+        """
+        The (profile, rescale factor) of the precomputed plans of the nearest split and
+        the kcal targets around the limits' kcal, the nearest first. Empty outside the grid.
+        """
+        if any(limits.get(limit) for limit in FIXED_LIMITS):
+            return []
+        key = (','.join(sorted(allergy for allergy in limits.get('allergies', []) if allergy)),
+               bool(limits.get('low_salt')))
+        splits = self.index.get(key)
+        if not splits:
+            return []
+        split = np.asarray(get_split(limits))
+        nearest = min(splits, key=lambda candidate: np.abs(np.asarray(candidate) - split).max())
+        if np.abs(np.asarray(nearest) - split).max() > SPLIT_TOLERANCE:
+            return []
+        kcal_limits, profiles = splits[nearest]
+        kcal_limit = limits.get('kcal_limit') or 2000
+        i = int(np.searchsorted(kcal_limits, kcal_limit))
+        candidates = [(int(profiles[j]), kcal_limit / kcal_limits[j])
+                      for j in [i - 1, i] if 0 <= j < len(kcal_limits)]
+        return sorted([(profile, factor) for profile, factor in candidates if abs(factor - 1) <= MAX_RESCALE],
+                      key=lambda candidate: abs(candidate[1] - 1))
+
+    def get_rescaled_plans(self, food_catalog, profile, factor, days, template):
+        """The (rows, portions) of the profile's days times the factor, or None if they break a limit"""
+        plans = []
+        for day_count in range(days):
+            start, end = self.offsets[profile * self.days + day_count:profile * self.days + day_count + 2]
+            rows, portions = self.rows[start:end], self.portions[start:end] * factor
+            if (portions > template.food_limit + 1e-9).any():
+                return None
+            if food_catalog.get_nutrient('fibre')[rows] @ portions < template.fibre_limit - 1e-6:
+                return None
+            if template.limits.get('low_salt') and (
+                    food_catalog.get_nutrient('salt')[rows] @ portions > template.salt_limit + 1e-6 or
+                    food_catalog.get_nutrient('sodium')[rows] @ portions > template.sodium_limit + 1e-6):
+                return None
+            plans.append((rows, portions))
+        return plans
+
+    def get_served_limits(self, profile, limits):
+        """
+        The limits the profile's plans meet once rescaled: the requested kcal, but the macro
+        kcal of the profile's split, which may be SPLIT_TOLERANCE off the requested split.
+        """
+        kcal_limit = limits.get('kcal_limit') or 2000
+        carb, protein, fat = self.splits[profile].tolist()
+        return dict(limits, kcal_limit=kcal_limit, carb_kcal_limit=kcal_limit * carb,
+                    protein_kcal_limit=kcal_limit * protein, fat_kcal_limit=kcal_limit * fat)
+
+    def get_daily_meal_plans(self, food_catalog, limits, days):
+        """
+        The nearest precomputed plans rescaled to the limits' kcal as DailyMealPlans,
+        or None if the limits are outside the grid or the rescaled plans would break a limit.
+        The days' limits are the ones they meet (get_served_limits).
+        The days are not solved: their solution is None.
+        """
+        if food_catalog.version != self.version or days > self.days:
+            return None
+        template = None
+        for profile, factor in self.lookup(limits):
+            if template is None:
+                template = algorithm.DailyMealPlan(food_catalog, limits=limits, cache=None)
+            plans = self.get_rescaled_plans(food_catalog, profile, factor, days, template)
+            if plans is None:
+                continue
+            served_limits = self.get_served_limits(profile, limits)
+            daily_meal_plans = []
+            for day_count, (rows, portions) in enumerate(plans):
+                day = algorithm.DailyMealPlan(food_catalog, limits=served_limits, day=str(day_count), cache=None)
+                x = np.zeros(len(food_catalog))
+                x[rows] = portions
+                day.set_optimal_solution(x)
+                daily_meal_plans.append(day)
+            return daily_meal_plans
+        return None
+
+
+_library = None
+_library_mtime = None
+
+
+def get_library(path=LIBRARY_PATH):
+    """The process wide library, reloaded when the file changes. None if it has not been built."""
+    global _library, _library_mtime
+    if not os.path.exists(path):
+        return None
+    mtime = os.stat(path).st_mtime_ns
+    if _library is None or mtime != _library_mtime:
+        _library = PlanLibrary.load(path)
+        _library_mtime = mtime
+    return _library
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Precompute the meal plans of the profile grid')
+    parser.add_argument('--days', type=int, default=LIBRARY_DAYS)
+    parser.add_argument('--workers', type=int, default=None, help='Defaults to the CPU count')
+    parser.add_argument('--output', default=LIBRARY_PATH)
+    args = parser.parse_args()
+
+    library = PlanLibrary.build(days=args.days, workers=args.workers)
+    library.save(args.output)
+    print(f'Saved the plans of {len(library)} profiles to {args.output}')
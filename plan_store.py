@@ -0,0 +1,118 @@
+import os
+import re
+import time
+import threading
+import pandas as pd
+import metrics
+
+PLANS_DIR = 'daily_meal_plans'
+
+# (new_meal_plan, low_salt) -> (directory, meal plan file pattern, nutrients file pattern)
+VARIANTS = {
+    (True, True): ('new_low_salt', r'\d+_.*meal_plan.*\.csv$', r'\d+_.*nutrients.*\.csv$'),
+    (True, False): ('new', r'\d+_.*meal_plan\.csv$', r'\d+_.*nutrients\.csv$'),
+    (False, True): ('pre_low_salt', r'\d+_.*meal_plan_low_salt\.csv$', r'\d+_.*nutrients_low_salt\.csv$'),
+    (False, False): ('pre', r'\d+_.*meal_plan\.csv$', r'\d+_.*nutrients\.csv$'),
+}
+
+
+def read_meal_plan(path):
+    """A meal plan CSV as the dict the template renders, with a Total row and salt in grams"""
+    df = pd.read_csv(path, sep=",")
+    df = pd.concat([df, df.sum(numeric_only=True).to_frame().T], ignore_index=True)
+    df.loc[df.index[-1], 'name'] = 'Total'
+    has_lactose = df['lactose'].iloc[-1] != 0
+    df['salt'] = df['salt'].div(1000)  # mg -> g
+    return df.round(1).to_dict('list'), has_lactose
+
+
+def read_nutrients(path):
+    df = pd.read_csv(path, sep=",")
+    df = df.set_index('Unnamed: 0')
+    df = df.T
+    has_lactose = df['lactose'].iloc[-1] != 0
+    return df.round(1).to_dict('list'), has_lactose
+
+
+class PlanStore():
+    """
+    The precalculated meal plans in memory, ready for the template.
+
+    Every variant (new/pre, low salt or not) is read from its directory once,
+    and read again only when a file in the directory has been added, removed or changed.
+    The directories are checked at most once every check_interval seconds.
+    """
+
+    def __init__(self, plans_dir=PLANS_DIR, check_interval=1.0):
+        self.plans_dir = plans_dir
+        self.check_interval = check_interval
+        self.variants = {}  # (new_meal_plan, low_salt) -> (signature, checked_at, meal_plans, nutrients)
+        self.lock = threading.Lock()
+
+    def preload(self):
+        for new_meal_plan, low_salt in VARIANTS:
+            self.get_variant(new_meal_plan, low_salt)
+
+    def get_signature(self, directory):
+        if not os.path.isdir(directory):
+            return ()
+        with os.scandir(directory) as entries:
+            return tuple(sorted(
+                (entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+                for entry in entries if entry.name.endswith('.csv')))
+
+    def load_variant(self, directory, meal_plan_pattern, nutrients_pattern):
+        """Day -> (data, has_lactose) of the meal plans and nutrients in the directory"""
+        meal_plans = {}
+        nutrients = {}
+        if not os.path.isdir(directory):
+            return meal_plans, nutrients
+        with metrics.timer('plan_store_load', directory=directory) as stage:
+            for fname in os.listdir(directory):
+                path = os.path.join(directory, fname)
+                if re.match(meal_plan_pattern, fname):
+                    meal_plans[int(fname.split('_')[0])] = read_meal_plan(path)
+                elif re.match(nutrients_pattern, fname):
+                    nutrients[int(fname.split('_')[0])] = read_nutrients(path)
+            stage['rows'] = len(meal_plans) + len(nutrients)
+        return meal_plans, nutrients
+
+    def get_variant(self, new_meal_plan, low_salt):
+        key = (bool(new_meal_plan), bool(low_salt))
+        directory_name, meal_plan_pattern, nutrients_pattern = VARIANTS[key]
+        directory = os.path.join(self.plans_dir, directory_name)
+        with self.lock:
+            variant = self.variants.get(key)
+            if variant is not None and time.time() - variant[1] < self.check_interval:
+                return variant[2], variant[3]
+
+            signature = self.get_signature(directory)
+            if variant is None or variant[0] != signature:
+                meal_plans, nutrients = self.load_variant(
+                    directory, meal_plan_pattern, nutrients_pattern)
+            else:
+                meal_plans, nutrients = variant[2], variant[3]
+            self.variants[key] = (signature, time.time(), meal_plans, nutrients)
+            return meal_plans, nutrients
+
+    def reload(self, new_meal_plan, low_salt):
+        """Forces the variant to be read again, e.g. right after writing new meal plans"""
+        with self.lock:
+            self.variants.pop((bool(new_meal_plan), bool(low_salt)), None)
+
+    def get_nutrients_and_meal_plans(self, days, allergy=None, low_salt=None, new_meal_plan=False):
+        meal_plans, nutrients = self.get_variant(new_meal_plan, low_salt)
+
+        def get_first_days(info_dict):
+            info_list = []
+            for key in sorted(info_dict):
+                info, has_lactose = info_dict[key]
+                if allergy and has_lactose:
+                    continue  # TODO: this causes a slight change of same food category on successive days
+                              # This can be fixed in the algorithm level
+                info_list.append(info)
+                if len(info_list) == days:
+                    break
+            return info_list
+
+        return get_first_days(meal_plans), get_first_days(nutrients)
@@ -0,0 +1,188 @@
+'''
+Benchmarks of the hot paths: web app startup, data import, LP optimization, meal plan
+post-processing and meal plan page rendering. Runs offline on synthetic Fineli shaped catalogs
+(tests/synthetic_catalog.py), so the scaling with the catalog size can be tracked too.
+
+Run from the project root:
+    python -m tests.run_benchmarks --output before.json    # on the build machine, before a change
+    python -m tests.run_benchmarks --baseline before.json
+
+With --baseline the exit code is 1 if any benchmark got slower than tolerance x baseline,
+or if importing the web app (a gunicorn worker's boot) takes longer than --import-budget seconds.
+'''
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import subprocess
+import argparse
+import platform
+import tempfile
+import contextlib
+import numpy as np
+import pandas as pd
+import scipy
+sys.path.insert(0, '..')
+import algorithm
+import catalog
+import data_import
+import plan_cache
+import plan_store
+from tests import synthetic_catalog
+
+IMPORT_BUDGET = 2.0  # seconds
+
+
+def measure(func, repeat=3):
+    """The best wall time of func in seconds, with the prints of the algorithm silenced"""
+    times = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def measure_plan(func, repeat=3):
+    """measure for the optimizations, or None if the synthetic catalog has no meal plan for them"""
+    try:
+        return measure(func, repeat)
+    except algorithm.MealPlanError as err:
+        print(f'Recorded as infeasible: {err}', file=sys.stderr)
+        return None
+
+
+def measure_import(module, repeat=3):
+    """The best time of importing the module in a fresh interpreter, without the interpreter's own startup"""
+    code = f'import time\nstart = time.perf_counter()\nimport {module}\nprint(time.perf_counter() - start)'
+    times = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, check=True, universal_newlines=True).stdout
+        times.append(float(output.splitlines()[-1]))
+    return min(times)
+
+
+def run_benchmarks(sizes, days_list, repeat):
+    results = {'startup.import_app': measure_import('app', repeat)}
+    work_dir = tempfile.mkdtemp()
+    try:
+        for n in sizes:
+            csv_path = os.path.join(work_dir, f'resultset_{n}.csv')
+            synthetic_catalog.write_catalog(csv_path, n)
+
+            results[f'import.get_data[{n}]'] = measure(
+                lambda: data_import.get_data(csv_path), repeat)
+            df_raw = data_import.get_data(csv_path)
+            results[f'import.clean_data[{n}]'] = measure(
+                lambda: data_import.clean_data(df_raw), repeat)
+            food_catalog = catalog.Catalog.from_dataframe(data_import.clean_data(df_raw))
+            limits = {'allergies': [''], 'low_salt': True}
+
+            def solve_day():
+                algorithm.DailyMealPlan(food_catalog, limits=limits, cache=None).calculate_optimal_meal_plan()
+            results[f'optimize.day[{n}]'] = measure_plan(solve_day, repeat)
+
+            for days in days_list:
+                def plan_days():
+                    plan_cache.default_cache.clear()
+                    planner = algorithm.MultiDayMealPlanner(food_catalog, limits=limits, seed=0)
+                    list(planner.get_daily_meal_plans(days))
+                results[f'optimize.plan[{n},{days}d]'] = measure_plan(plan_days, repeat)
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                day = algorithm.DailyMealPlan(food_catalog, limits=limits, cache=None)
+                day.calculate_optimal_meal_plan()
+
+            def post_process():
+                day.set_optimal_solution(day.solution.x)
+                day.get_optimal_meal_plan()
+                day.get_total_nutrients()
+            results[f'post_process.day[{n}]'] = measure(post_process, repeat)
+
+        results['page.meal_plan[30d]'] = benchmark_page(work_dir, repeat)
+    finally:
+        shutil.rmtree(work_dir)
+    return results
+
+
+def benchmark_page(work_dir, repeat):
+    """Loading 30 days of pre-calculated meal plans and rendering the meal plan page"""
+    import app
+    plans_dir = os.path.join(work_dir, 'daily_meal_plans')
+    shutil.copytree('daily_meal_plans/pre', os.path.join(plans_dir, 'pre'))
+
+    def render_page():
+        store = plan_store.PlanStore(plans_dir)
+        meal_plans, nutrients = store.get_nutrients_and_meal_plans(30)
+        with app.app.test_request_context():
+            app.render_template('meal_plan.html', meal_plans=meal_plans, nutrients=nutrients, days=30)
+    return measure(render_page, repeat)
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    print(f'\n{"benchmark":40}{"baseline (ms)":>15}{"now (ms)":>12}{"ratio":>8}')
+    for name, seconds in results.items():
+        base = baseline.get(name)
+        ratio = seconds / base if base and seconds is not None else float('nan')
+        flag = ''
+        if base and ratio > tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        base_ms = f'{base * 1000:.1f}' if base else '-'
+        now_ms = f'{seconds * 1000:.1f}' if seconds is not None else 'infeasible'
+        print(f'{name:40}{base_ms:>15}{now_ms:>12}{ratio:>8.2f}{flag}')
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the meal planner hot paths')
+    # Below ~2000 foods the variety rules run out of foods for a month of low salt plans
+    parser.add_argument('--sizes', type=int, nargs='+', default=[2000, 10000],
+                        help='Catalog sizes, up to a million foods')
+    parser.add_argument('--days', type=int, nargs='+', default=[7, 30], help='Plan lengths')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', help='Compare against this results JSON')
+    parser.add_argument('--tolerance', type=float, default=1.25)
+    parser.add_argument('--import-budget', type=float, default=IMPORT_BUDGET,
+                        help='Seconds importing the web app may take')
+    args = parser.parse_args()
+    logging.getLogger('meal_planner.metrics').setLevel(logging.WARNING)
+
+    report = {
+        'meta': {
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'scipy': scipy.__version__,
+            'machine': platform.machine(),
+        },
+        'results': run_benchmarks(args.sizes, args.days, args.repeat),
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    failed = False
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(report['results'], baseline, args.tolerance)
+        if regressions:
+            print(f'\n{len(regressions)} benchmark(s) slower than {args.tolerance}x the baseline')
+            failed = True
+    else:
+        print(json.dumps(report, indent=2))
+    if report['results']['startup.import_app'] > args.import_budget:
+        print(f'\nImporting the app took {report["results"]["startup.import_app"]:.2f}s, '
+              f'over the budget of {args.import_budget}s')
+        failed = True
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,94 @@
+'''
+Compares the greedy day by day planner with the joint weekly MILP
+on wall time and on the quality of the resulting week.
+Run from the project root: python -m tests.run_weekly_benchmark [days]
+
+With --sizes the planners are compared on synthetic catalogs of those sizes instead
+of the real one, e.g. for choosing catalog.WEEKLY_MAX_FOODS:
+    python -m tests.run_weekly_benchmark 7 --sizes 1000 2000 4000 --time-limit 15
+The MILP is run on every size here, without the WEEKLY_MAX_FOODS fallback.
+'''
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+import sys
+sys.path.insert(0, '..')
+import algorithm
+import catalog
+from tests import synthetic_catalog
+
+
+def get_plan_quality(daily_meal_plans):
+    meal_plans = [day.get_optimal_meal_plan() for day in daily_meal_plans]
+    totals = [day.get_total_nutrients() for day in daily_meal_plans]
+
+    def groups(meal_plan):
+        return set(meal_plan['category']) | (set(meal_plan['extra_category']) - {''})
+
+    shared_groups = sum(
+        len(groups(today) & groups(yesterday))
+        for yesterday, today in zip(meal_plans, meal_plans[1:]))
+    foods = np.concatenate([meal_plan.index.to_numpy() for meal_plan in meal_plans])
+    return {
+        'sugar (g)': round(sum(total['sugar'] for total in totals), 2),
+        'max kcal error': round(max(abs(total['kcal'] - 2000) for total in totals), 1),
+        'groups shared by consecutive days': shared_groups,
+        'distinct foods': len(set(foods)),
+        'foods': len(foods),
+    }
+
+
+def run_planner(planner, days):
+    start = time.time()
+    daily_meal_plans = list(planner.get_daily_meal_plans(days))
+    running_time = time.time() - start
+    quality = get_plan_quality(daily_meal_plans)
+    quality['time (s)'] = round(running_time, 2)
+    return quality
+
+
+def compare(food_catalog, days, time_limit):
+    limits = {'allergies': [''], 'low_salt': False}
+    weekly_planner = algorithm.WeeklyMealPlanner(food_catalog, limits, time_limit=time_limit, max_foods=None)
+    results = {
+        'greedy': run_planner(algorithm.MultiDayMealPlanner(food_catalog, limits, seed=0), days),
+        'joint': run_planner(weekly_planner, days),
+    }
+    results['greedy']['weeks planned day by day'] = -(-days // 7)
+    results['joint']['weeks planned day by day'] = len(weekly_planner.fallback_weeks)
+
+    print(f'\n{days} days over {len(food_catalog)} foods, MILP time limit {time_limit}s per week\n')
+    print(f'{"":40}{"greedy":>10}{"joint":>10}')
+    for key in results['greedy']:
+        print(f'{key:40}{results["greedy"][key]:>10}{results["joint"][key]:>10}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('days', type=int, nargs='?', default=7)
+    parser.add_argument('--sizes', type=int, nargs='+', help='synthetic catalog sizes (foods in the CSV)')
+    parser.add_argument('--time-limit', type=float, default=algorithm.WEEKLY_TIME_LIMIT, help='seconds per week')
+    args = parser.parse_args()
+
+    if not args.sizes:
+        compare(catalog.get_catalog(), args.days, args.time_limit)
+        return
+    for size in args.sizes:
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            csv_path = os.path.join(tmp_dir, 'resultset.csv')
+            synthetic_catalog.write_catalog(csv_path, size)
+            food_catalog = catalog.build_catalog(csv_path, os.path.join(tmp_dir, 'cache'))
+            try:
+                compare(food_catalog, args.days, args.time_limit)
+            except algorithm.MealPlanError as err:
+                print(f'\n{len(food_catalog)} foods: {err}')
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
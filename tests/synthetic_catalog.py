@@ -0,0 +1,142 @@
+'''
+Synthetic food catalogs in the format of Fineli's resultset.csv, for profiling the
+import pipeline and the optimizer at sizes beyond the real catalog (10k - 1M foods).
+
+The catalogs pass validate_original_csv_schema, and clean_data drops roughly the same
+share of outliers as from the real data:
+- Foods belong to food groups (meat, dairy, grains, ...) with typical macronutrients.
+  Category sizes follow a long tailed distribution like Fineli's categories do.
+- The energy is calculated from the macronutrients, so kcal_ratio is about 1,
+  except for a small share of foods with a mis-recorded energy (kcal_ratio > 1.3).
+- Alcoholic drinks, the unwanted food categories, '<0.1' values and missing
+  fibre, sodium and lactose values are included.
+
+Run from the project root:
+    python -m tests.synthetic_catalog 100000 --output resultset_100k.csv
+'''
+import argparse
+import numpy as np
+import pandas as pd
+
+# name, share of foods, category words, (fat, carbohydrate, protein, fibre) g/100g,
+# sugar share of carbohydrates, sodium mg/100g, share of foods with lactose, alcohol g/100g
+FOOD_GROUPS = [
+    ('meat', 0.16, ['Chicken Fillet', 'Pork Chop', 'Beef Steak', 'Minced Meat', 'Lamb', 'Kebab',
+                    'Ham', 'Hamburger', 'Sausage', 'Meatballs', 'Turkey'], (12, 3, 20, 0.3), 0.2, 600, 0.1, 0),
+    ('fish', 0.07, ['Salmon', 'Cod', 'Hake', 'Shrimp', 'Tuna', 'Herring', 'Pike'], (7, 1, 20, 0), 0.1, 350, 0.05, 0),
+    ('dairy', 0.12, ['Cheese', 'Yoghurt', 'Milk', 'Cottage Cheese', 'Quark', 'Cream', 'Ice Cream'],
+     (9, 8, 9, 0), 0.8, 250, 0.9, 0),
+    ('grains', 0.18, ['Rice', 'Pasta', 'Porridge', 'White Bread', 'Rye Bread', 'Crispbread',
+                      'Breakfast Cereal', 'Oat Flakes', 'Pancake'], (4, 45, 9, 5), 0.1, 350, 0.1, 0),
+    ('vegetables', 0.17, ['Potato', 'Carrot', 'Tomato', 'Salad', 'Bean', 'Pea', 'Tofu', 'Broccoli',
+                          'Apple', 'Banana', 'Lingonberry', 'Orange'], (0.7, 10, 2, 2.5), 0.6, 30, 0.02, 0),
+    ('dishes', 0.14, ['Casserole', 'Soup', 'Pizza', 'Pie', 'Stew', 'Lasagne', 'Wok'],
+     (6, 12, 7, 1.5), 0.2, 380, 0.4, 0),
+    ('sweets', 0.08, ['Cake', 'Cookie', 'Chocolate', 'Jam', 'Candy', 'Bun'], (18, 55, 5, 2), 0.6, 150, 0.6, 0),
+    ('drinks', 0.06, ['Juice', 'Soft Drink', 'Beer', 'Wine', 'Coffee Drink', 'Smoothie'],
+     (0.3, 9, 0.5, 0.2), 0.9, 10, 0.1, 2.5),
+    ('unwanted', 0.02, ['Salt', 'Flour', 'Sweetener', 'Baking Yeast', 'Gelatin', 'Baking Powder'],
+     (1, 60, 8, 3), 0.1, 2000, 0, 0),
+]
+
+PREPARATIONS = ['Boiled', 'Fried', 'Oven-Baked', 'Raw', 'Frozen', 'Low Fat', 'Organic',
+                'Without Salt', 'With Salt', 'Home-Made', 'Industrial', 'Canned']
+VARIETIES = ['Classic', 'Wholegrain', 'Light', 'Finnish', 'Spicy', 'Mixed', 'Smoked', 'Vegetable',
+             'Cream', 'Garlic', 'Lemon', 'Cheese', 'Chicken', 'Rice', 'Pasta']
+
+COLUMNS = ['name', 'energy,calculated (kJ)', 'fat, total (g)', 'carbohydrate, available (g)',
+           'protein, total (g)', 'fibre, total (g)', 'sugars, total (g)', 'alcohol (g)',
+           'sodium (mg)', 'salt (mg)', 'lactose (g)']
+
+
+def format_grams(values):
+    """
+    Fineli's string formatting: one decimal, and '<0.1' for the traces.
+    Like in Fineli, every column has some traces, which makes pandas read it as strings.
+    """
+    strings = pd.Series(values).round(1).map('{:.1f}'.format)
+    traces = (values > 0) & (values < 0.1)
+    if not traces.any():
+        traces[np.argmin(values)] = True
+    strings[traces] = '<0.1'
+    return strings.to_numpy()
+
+
+def with_missing(values, rng, share=0.05):
+    values = values.round(1)
+    values[rng.rand(len(values)) < share] = np.nan
+    return values
+
+
+def generate_catalog(n, seed=0, outlier_share=0.015):
+    """A DataFrame of n foods with the columns of resultset.csv"""
+    rng = np.random.RandomState(seed)
+
+    shares, words, means, sugar_shares, sodium_means, lactose_shares, alcohol_means = \
+        zip(*[food_group[1:] for food_group in FOOD_GROUPS])
+
+    # Categories: about 6 foods per category, with long tailed category sizes
+    n_categories = max(len(FOOD_GROUPS), n // 6)
+    category_group = rng.choice(len(FOOD_GROUPS), n_categories, p=np.array(shares) / sum(shares))
+    category_names = []
+    used_words = set()
+    for i, group in enumerate(category_group):
+        word = words[group][rng.randint(len(words[group]))]
+        # A variety keeps the category names unique also in catalogs of a million foods
+        category_names.append(word if word not in used_words else f'{VARIETIES[i % len(VARIETIES)]} {word} {i}')
+        used_words.add(word)
+    category_names = np.array(category_names, dtype=object)
+    category_size = 1 / np.arange(1, n_categories + 1) ** 0.8
+    category = rng.choice(n_categories, n, p=category_size / category_size.sum())
+    group = category_group[category]
+
+    # Macronutrients: the group's typical values, varied per category and again per food
+    category_factor = rng.lognormal(0, 0.4, (n_categories, 4))
+    macros = np.array(means)[group] * category_factor[category] * rng.lognormal(0, 0.25, (n, 4))
+    alcohol = np.array(alcohol_means)[group] * rng.lognormal(0, 0.8, n)
+    alcohol[rng.rand(n) < 0.5] = 0
+    total = macros.sum(axis=1) + alcohol
+    macros[total > 95] *= (95 / total[total > 95])[:, None]
+    fat, carb, protein, fibre = macros.T
+
+    sugar = carb * np.clip(np.array(sugar_shares)[group] * rng.lognormal(0, 0.5, n), 0, 1)
+    sodium = np.array(sodium_means)[group] * rng.lognormal(0, 0.7, n)
+    has_lactose = rng.rand(n) < np.array(lactose_shares)[group]
+    lactose = np.where(has_lactose, np.minimum(carb, rng.gamma(1.5, 2.5, n)), 0)
+
+    # Energy (kJ) from the macronutrients, as clean_data's kcal_ratio expects
+    kj = (fat * 37 + carb * 17 + protein * 17 + fibre * 8 + alcohol * 29) * rng.normal(1, 0.02, n)
+    outliers = rng.rand(n) < outlier_share
+    kj[outliers] *= rng.uniform(1.35, 2.5, outliers.sum())
+
+    names = pd.Series(category_names[category]) + ', ' + \
+        pd.Series(np.array(PREPARATIONS, dtype=object)[rng.randint(len(PREPARATIONS), size=n)])
+    names = names + np.where(rng.rand(n) < 0.3, ', ' + pd.Series(np.arange(n)).astype(str), '')
+
+    return pd.DataFrame({
+        'name': names,
+        'energy,calculated (kJ)': np.clip(kj.round(), 0, 4000).astype(int),
+        'fat, total (g)': format_grams(fat),
+        'carbohydrate, available (g)': format_grams(carb),
+        'protein, total (g)': format_grams(protein),
+        'fibre, total (g)': with_missing(fibre, rng),
+        'sugars, total (g)': format_grams(sugar),
+        'alcohol (g)': format_grams(alcohol),
+        'sodium (mg)': with_missing(sodium, rng),
+        'salt (mg)': format_grams(sodium * 2.54),
+        'lactose (g)': with_missing(lactose, rng, share=0.15),
+    }, columns=COLUMNS)
+
+
+def write_catalog(path, n, seed=0):
+    generate_catalog(n, seed).to_csv(path, sep=';', index=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic Fineli shaped catalog')
+    parser.add_argument('n', type=int, help='Number of foods')
+    parser.add_argument('--output', default='resultset_synthetic.csv')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    write_catalog(args.output, args.n, args.seed)
+    print(f'Wrote {args.n} foods to {args.output}')
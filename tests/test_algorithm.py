@@ -0,0 +1,191 @@
+import unittest
+import numpy as np
+import pandas as pd
+
+import sys
+sys.path.insert(0, '..')
+import algorithm
+import catalog
+
+
+def get_test_meals(n=120, seed=0):
+    """A small catalog with the columns of data_import.clean_data output"""
+    rng = np.random.RandomState(seed)
+    words = ['Chicken', 'Pork', 'Beef', 'Fish', 'Cheese', 'Porridge', 'Rice', 'Pasta', 'Bread',
+             'Yoghurt', 'Apple', 'Oat', 'Bean', 'Soup', 'Salad', 'Potato', 'Lamb', 'Tofu']
+    categories = [f'{words[i % len(words)]} Dish {i % 40}' for i in range(n)]
+    carb_kcal = rng.gamma(2, 60, n)
+    protein_kcal = rng.gamma(2, 25, n)
+    fat_kcal = rng.gamma(2, 20, n)
+    return pd.DataFrame({
+        'name': [f'{category}, Variant {i}' for i, category in enumerate(categories)],
+        'category': categories,
+        'extra_category': [words[i % len(words)].lower() if i % 3 else '' for i in range(n)],
+        'kcal': carb_kcal + protein_kcal + fat_kcal,
+        'sugar': rng.gamma(1, 3, n),
+        'fibre': rng.gamma(2, 1.5, n),
+        'carb_kcal': carb_kcal,
+        'protein_kcal': protein_kcal,
+        'fat_kcal': fat_kcal,
+        'salt': rng.gamma(2, 200, n),
+        'sodium': rng.gamma(2, 80, n),
+        'lactose': np.where(rng.rand(n) < 0.3, rng.gamma(1, 2, n), 0.0),
+        'alc': np.zeros(n),
+    }, index=np.arange(1000, 1000 + n))
+
+
+class TestDailyMealPlan(unittest.TestCase):
+
+    def setUp(self):
+        self.df_meals = get_test_meals()
+        self.limits = {'allergies': [''], 'low_salt': False}
+
+    def test_optimal_meal_plan_meets_limits(self):
+        day = algorithm.DailyMealPlan(self.df_meals, limits=self.limits, cache=None)
+        meal_plan = day.get_optimal_meal_plan()
+        total = day.get_total_nutrients()
+
+        self.assertEqual(day.solution.status, 0)
+        self.assertTrue((meal_plan['grams'] <= 500).all())
+        self.assertTrue((meal_plan['grams'] >= 10).all())
+        self.assertEqual(meal_plan['grams'].tolist(), sorted(meal_plan['grams'], reverse=True))
+        # Rounding to 10g makes the totals approximate
+        self.assertAlmostEqual(total['kcal'], 2000, delta=100)
+        self.assertAlmostEqual(total['protein_kcal'], 600, delta=50)
+        self.assertGreaterEqual(total['fibre'], 20)
+
+    def test_optimal_meal_plan_is_calculated_once(self):
+        day = algorithm.DailyMealPlan(self.df_meals, limits=self.limits, cache=None)
+        self.assertIs(day.get_optimal_meal_plan(), day.get_optimal_meal_plan())
+        self.assertIs(day.get_total_nutrients(), day.get_total_nutrients())
+
+        day.invalidate()
+        self.assertIsNot(day.optimal_meal_plan, day.get_optimal_meal_plan())
+
+    def test_lactose_allergy(self):
+        limits = {'allergies': ['lactose'], 'low_salt': False}
+        day = algorithm.DailyMealPlan(self.df_meals, limits=limits, cache=None)
+        self.assertEqual(day.get_total_nutrients()['lactose'], 0)
+
+    def test_unreachable_limits_are_rejected_before_solving(self):
+        limits = dict(self.limits, kcal_limit=50000)
+        day = algorithm.DailyMealPlan(self.df_meals, limits=limits, cache=None)
+        with self.assertRaises(algorithm.MealPlanError) as context:
+            day.calculate_optimal_meal_plan()
+
+        self.assertIsNone(day.solution)
+        self.assertIn('kcal', [violation['constraint'] for violation in context.exception.violations])
+
+    def test_no_available_foods_is_rejected_before_solving(self):
+        day = algorithm.DailyMealPlan(self.df_meals, limits=self.limits, cache=None)
+        day.exclude_foods(self.df_meals.index)
+        with self.assertRaises(algorithm.MealPlanError) as context:
+            day.calculate_optimal_meal_plan()
+        self.assertIn('kcal', [violation['constraint'] for violation in context.exception.violations])
+        self.assertEqual(algorithm.get_row_range(np.ones(3), np.zeros(3), np.zeros(3), 20), (0, 0))
+
+    def test_time_solver_methods(self):
+        solve_times = algorithm.time_solver_methods(self.df_meals, self.limits, methods=['highs', 'unknown'])
+        self.assertEqual(list(solve_times), ['highs'])
+        with self.assertRaises(algorithm.MealPlanError):
+            algorithm.time_solver_methods(self.df_meals, dict(self.limits, kcal_limit=50000), methods=['highs'])
+
+    def test_sensitivity(self):
+        day = algorithm.DailyMealPlan(self.df_meals, limits=self.limits, cache=None)
+        sensitivity = day.get_sensitivity()
+
+        self.assertEqual(sensitivity.loc['fibre', 'type'], '>=')
+        self.assertAlmostEqual(sensitivity.loc['kcal', 'value'], 2000, places=3)
+        self.assertTrue((sensitivity['slack'] >= 0).all())
+        np.testing.assert_allclose(
+            sensitivity.loc['fibre', 'value'], day.get_total_nutrients()['fibre'], rtol=0.1)
+
+    def test_days_share_the_catalog(self):
+        food_catalog = catalog.Catalog.from_dataframe(self.df_meals)
+        nutrients = food_catalog.nutrients.copy()
+        planner = algorithm.MultiDayMealPlanner(food_catalog, limits=self.limits)
+        days = list(planner.get_daily_meal_plans(2))
+
+        for day in days:
+            self.assertIs(day.catalog, food_catalog)
+        np.testing.assert_array_equal(food_catalog.nutrients, nutrients)
+        self.assertFalse(food_catalog.nutrients.flags.writeable)
+        meal_plan = days[1].get_optimal_meal_plan()
+        pd.testing.assert_frame_equal(
+            meal_plan[['name', 'category']], self.df_meals.loc[meal_plan.index, ['name', 'category']])
+
+    def test_successive_days_do_not_share_categories(self):
+        planner = algorithm.MultiDayMealPlanner(self.df_meals, limits=self.limits, seed=0)
+        meal_plans = [day.get_optimal_meal_plan() for day in planner.get_daily_meal_plans(3)]
+
+        for yesterday, today in zip(meal_plans, meal_plans[1:]):
+            self.assertFalse(set(yesterday['category']) & set(today['category']))
+            extra_categories = set(yesterday['extra_category']) - {''}
+            self.assertFalse(extra_categories & set(today['extra_category']))
+
+    def test_seeded_plans_are_reproducible(self):
+        def plan(seed):
+            planner = algorithm.MultiDayMealPlanner(self.df_meals, limits=self.limits, seed=seed)
+            return [day.get_meal_rows().tolist() for day in planner.get_daily_meal_plans(4)]
+
+        self.assertEqual(plan(1), plan(1))
+
+    def test_swap_foods(self):
+        planner = algorithm.MultiDayMealPlanner(self.df_meals, limits=self.limits, seed=0)
+        days = list(planner.get_daily_meal_plans(3))
+        meal_plan = days[0].get_optimal_meal_plan()
+        swapped_out, pinned = meal_plan.index[0], self.df_meals.index[days[0].candidates][-1]
+
+        changed = planner.swap_foods(days, 0, exclude=[swapped_out], pin=[pinned])
+        meal_plan = days[0].get_optimal_meal_plan()
+        self.assertIs(changed[0], days[0])
+        self.assertNotIn(swapped_out, meal_plan.index)
+        self.assertIn(pinned, meal_plan.index)
+        for yesterday, today in zip(days, days[1:]):
+            self.assertFalse(yesterday.get_categories()[0] & today.get_categories()[0])
+        with self.assertRaises(ValueError):
+            days[0].exclude_foods([-1])
+
+    def test_failed_swap_leaves_the_days_as_they_were(self):
+        planner = algorithm.MultiDayMealPlanner(self.df_meals, limits=self.limits, seed=0)
+        days = list(planner.get_daily_meal_plans(2))
+        rows = [day.get_meal_rows().tolist() for day in days]
+        available = days[0].available.copy()
+
+        with self.assertRaises(algorithm.MealPlanError):
+            planner.swap_foods(days, 0, exclude=self.df_meals.index[available][3:])
+        # Excluding a food and pinning it, which is no longer available
+        with self.assertRaises(ValueError):
+            planner.swap_foods(days, 0, exclude=self.df_meals.index[available][:1],
+                               pin=self.df_meals.index[available][:1])
+        np.testing.assert_array_equal(days[0].available, available)
+        self.assertFalse(days[0].swapped_out.any())
+        self.assertEqual([day.get_meal_rows().tolist() for day in days], rows)
+
+    def test_weeks_without_milp_are_planned_day_by_day(self):
+        milp = algorithm.milp
+        algorithm.milp = None  # As with scipy < 1.9
+        try:
+            planner = algorithm.WeeklyMealPlanner(self.df_meals, limits=self.limits)
+            days = list(planner.get_daily_meal_plans(9))
+        finally:
+            algorithm.milp = milp
+        self.assertEqual(planner.fallback_weeks, [0, 7])
+        self.assertEqual([day.day for day in days], [str(day_count) for day_count in range(9)])
+        for yesterday, today in zip(days, days[1:]):
+            self.assertFalse(yesterday.get_categories()[0] & today.get_categories()[0])
+
+    def test_weeks_with_too_many_foods_are_planned_day_by_day(self):
+        milp = algorithm.milp
+        algorithm.milp = None if milp is None else self.fail  # The MILP is not even tried
+        try:
+            planner = algorithm.WeeklyMealPlanner(self.df_meals, limits=self.limits, max_foods=10)
+            days = list(planner.get_daily_meal_plans(3))
+        finally:
+            algorithm.milp = milp
+        self.assertEqual(planner.fallback_weeks, [0])
+        self.assertEqual(len(days), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
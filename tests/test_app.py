@@ -0,0 +1,57 @@
+import gzip
+import json
+import unittest
+
+import sys
+sys.path.insert(0, '..')
+import app
+import catalog
+from tests.test_algorithm import get_test_meals
+
+
+class TestMealPlanApi(unittest.TestCase):
+
+    def setUp(self):
+        self.catalog = catalog.get_catalog
+        food_catalog = catalog.Catalog.from_dataframe(get_test_meals())
+        catalog.get_catalog = lambda *args: food_catalog
+        app.api_cache.clear()
+        self.client = app.app.test_client()
+
+    def tearDown(self):
+        catalog.get_catalog = self.catalog
+
+    def test_meal_plan_json(self):
+        response = self.client.get('/api/meal-plan?days=2&allergies=lactose&low_salt=1')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(len(data['meal_plans']), 2)
+        self.assertEqual(data['limits']['allergies'], ['lactose'])
+        self.assertEqual(data['source'], 'optimizer')
+        self.assertEqual(data['served_limits'], data['limits'])
+        day = data['meal_plans'][0]
+        self.assertEqual(len(day['foods']['id']), len(day['foods']['name']))
+        self.assertAlmostEqual(day['total']['kcal'], 2000, delta=50)
+        self.assertEqual(day['total']['lactose'], 0)
+
+        etag = response.headers['ETag']
+        response = self.client.get('/api/meal-plan?days=2&allergies=lactose&low_salt=1',
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get('/api/meal-plan?days=2&allergies=lactose&low_salt=1',
+                                   headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.data)), data)
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.client.get('/api/meal-plan?days=0').status_code, 400)
+        self.assertEqual(self.client.get('/api/meal-plan?allergies=shellfish').status_code, 400)
+        response = self.client.get('/api/meal-plan?days=1&seed=x')
+        self.assertEqual(response.status_code, 400)
+        for params in ['kcal_limit=0', 'kcal_limit=-100', 'kcal_limit=nan', 'carb_share=1.5', 'fat_share=inf']:
+            self.assertEqual(self.client.get(f'/api/meal-plan?days=1&{params}').status_code, 400, params)
+
+
+if __name__ == '__main__':
+    unittest.main()
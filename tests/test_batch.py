@@ -0,0 +1,41 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+import sys
+sys.path.insert(0, '..')
+import batch
+from tests import synthetic_catalog
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.csv_path = os.path.join(self.tmp_dir, 'resultset.csv')
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        synthetic_catalog.write_catalog(self.csv_path, 2000)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_failed_profile_does_not_stop_the_batch(self):
+        profiles = [{'name': 'regular'}, {'name': 'too_much_fibre', 'fibre_limit': 500},
+                    {'name': 'low_salt', 'low_salt': True}]
+        output_dir = os.path.join(self.tmp_dir, 'batch')
+        results = batch.plan_profiles(profiles, days=1, workers=2, output_dir=output_dir,
+                                      csv_path=self.csv_path, cache_dir=self.cache_dir)
+
+        self.assertEqual([result['name'] for result in results], ['regular', 'too_much_fibre', 'low_salt'])
+        self.assertNotIn('error', results[0])
+        self.assertNotIn('error', results[2])
+        self.assertIn('error', results[1])
+        self.assertTrue(any(violation['constraint'] == 'fibre' for violation in results[1]['violations']))
+        with open(os.path.join(output_dir, 'results.json')) as f:
+            self.assertEqual(len(json.load(f)), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+
+import sys
+sys.path.insert(0, '..')
+import catalog
+
+
+def write_test_csv(path, names):
+    data = {
+        'name': names,
+        'energy,calculated (kJ)': [1000] * len(names),
+        'fat, total (g)': ['<0.1'] + ['5.0'] * (len(names) - 1),
+        'carbohydrate, available (g)': ['<0.1'] + ['40.0'] * (len(names) - 1),
+        'protein, total (g)': ['<0.1'] + ['10.0'] * (len(names) - 1),
+        'fibre, total (g)': [3.0] * len(names),
+        'sugars, total (g)': ['<0.1'] + ['2.0'] * (len(names) - 1),
+        'alcohol (g)': ['<0.1'] + ['0.0'] * (len(names) - 1),
+        'sodium (mg)': [100.0] * len(names),
+        'salt (mg)': ['<0.1'] + ['250.0'] * (len(names) - 1),
+        'lactose (g)': [2.0] + [0.0] * (len(names) - 1),
+    }
+    pd.DataFrame(data).to_csv(path, sep=';', index=False)
+
+
+class TestCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.csv_path = os.path.join(self.tmp_dir, 'resultset.csv')
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        write_test_csv(self.csv_path, [
+            'Water, Tap Water', 'Chicken Soup, Canned', 'Rice Porridge, Milk', 'Pork, Fillet'])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_load_catalog_is_memory_mapped(self):
+        food_catalog = catalog.load_catalog(self.csv_path, self.cache_dir)
+        df = food_catalog.to_dataframe()
+
+        self.assertEqual(len(food_catalog), 3)  # Water is dropped by clean_data
+        self.assertEqual(food_catalog.nutrients.shape, (len(catalog.NUTRIENT_COLUMNS), 3))
+        self.assertEqual(df['category'].tolist(), ['Chicken Soup', 'Rice Porridge', 'Pork'])
+        self.assertEqual(df['extra_category'].tolist(), ['chicken', 'porridge', 'pork'])
+        self.assertAlmostEqual(df['kcal'].iloc[0], 1000 / 4.184)
+
+        food_catalog = catalog.load_catalog(self.csv_path, self.cache_dir)
+        self.assertIsInstance(food_catalog.nutrients, np.memmap)
+
+    def test_cache_is_rebuilt_when_source_changes(self):
+        version = catalog.load_catalog(self.csv_path, self.cache_dir).version
+
+        # Same content with a new mtime keeps the cache
+        os.utime(self.csv_path, (0, 0))
+        self.assertEqual(catalog.load_catalog(self.csv_path, self.cache_dir).version, version)
+
+        write_test_csv(self.csv_path, ['Water, Tap Water', 'Beef, Minced'])
+        food_catalog = catalog.load_catalog(self.csv_path, self.cache_dir)
+        self.assertNotEqual(food_catalog.version, version)
+        self.assertEqual(food_catalog.names.tolist(), ['Beef, Minced'])
+
+    def test_category_and_allergen_indexes(self):
+        write_test_csv(self.csv_path, [
+            'Water, Tap Water', 'Chicken Soup, Canned', 'Rice Porridge, Milk', 'Rye Bread, Chicken',
+            'Chicken Soup, Creamy', 'Peanut Butter, Crunchy'])
+        food_catalog = catalog.load_catalog(self.csv_path, self.cache_dir)
+        names = food_catalog.names.tolist()
+
+        rows = food_catalog.get_category_rows(['Chicken Soup', 'Unknown'], ['', 'porridge'])
+        self.assertEqual(sorted(names[row] for row in rows),
+                         ['Chicken Soup, Canned', 'Chicken Soup, Creamy', 'Rice Porridge, Milk'])
+
+        mask = food_catalog.get_allergen_mask(['gluten', 'nuts'])
+        self.assertEqual(food_catalog.names[mask].tolist(), ['Rye Bread, Chicken', 'Peanut Butter, Crunchy'])
+        self.assertFalse(food_catalog.get_allergen_mask(['lactose']).any())  # Water is dropped
+        with self.assertRaises(ValueError):
+            food_catalog.get_allergen_mask(['shellfish'])
+
+    def test_missing_csv_is_fetched(self):
+        import fetcher
+        mirror_path = os.path.join(self.tmp_dir, 'mirror.csv')
+        os.replace(self.csv_path, mirror_path)
+        fetcher_class = fetcher.Fetcher
+        fetcher.Fetcher = lambda csv_path: fetcher_class(source=mirror_path, csv_path=csv_path)
+        try:
+            food_catalog = catalog.load_catalog(self.csv_path, self.cache_dir)
+        finally:
+            fetcher.Fetcher = fetcher_class
+        self.assertTrue(os.path.exists(self.csv_path))
+        self.assertEqual(len(food_catalog), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
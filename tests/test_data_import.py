@@ -1,3 +1,6 @@
+import os
+import tempfile
+import numpy as np
 import pandas as pd
 import unittest
 import pandera as pa
@@ -5,6 +8,7 @@ import pandera as pa
 import sys
 sys.path.insert(0, '..')
 import data_import
+from tests import synthetic_catalog
 
 
 class TestDataImport(unittest.TestCase):
@@ -37,6 +41,17 @@ class TestDataImport(unittest.TestCase):
         self.assertEqual(len(df_test), len(extra_cat_created_list))
         self.assertEqual(extra_categories_test, extra_cat_created_list)
 
+    def test_get_extra_category_list_priority(self):
+        df_test = pd.DataFrame(['Hamburger, Chicken Burger', 'Champignon Soup', 'Rice Cake',
+                                'Ham Slices', 'Milk, Lactose-Free'], columns=['name'])
+        extra_cat_created_list = data_import.get_extra_category_list(df_test)
+
+        self.assertEqual(['chicken', '', 'cake', 'ham ', ''], extra_cat_created_list)
+
+        extra_cat_created_list = data_import.get_extra_category_list(
+            df_test, extra_categories=['milk', 'soup', 'rice'])
+        self.assertEqual(['', 'soup', 'rice', '', 'milk'], extra_cat_created_list)
+
     def test_add_necessary_columns(self):
         data = {
             'name': ['Tämä on Ruuan kategoria, ja tämä tuotemerkki Beef, ja tää on detail'],
@@ -79,6 +94,42 @@ class TestDataImport(unittest.TestCase):
         self.assertEqual(df_valid['category'][0], 'Tämä on Ruuan kategoria')
         self.assertEqual(df_valid['extra_category'][0], 'beef')
 
+    def test_parse_numeric_columns(self):
+        df_test = pd.DataFrame({
+            'fineli': ['12.5', '<0.1', np.nan, '3'],
+            'other': [' 1,5', '<2', '', 'n/a'],
+            'numeric': [1.0, np.inf, np.nan, 4.0],
+        })
+        values, failures = data_import.parse_numeric_columns(df_test, ['fineli', 'other', 'numeric'])
+
+        self.assertEqual(values.shape, (4, 3))
+        self.assertEqual(values[:, 0].tolist(), [12.5, 0, 0, 3])
+        self.assertEqual(values[:, 1].tolist(), [1.5, 0, 0, 0])
+        self.assertEqual(values[:, 2].tolist(), [1, 0, 0, 4])
+        self.assertEqual(failures, {'other': 1})
+
+    def test_synthetic_catalog_is_imported_like_fineli(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_path = os.path.join(tmp_dir, 'resultset.csv')
+            synthetic_catalog.write_catalog(csv_path, 2000)
+            df = data_import.get_data(csv_path)
+        df_clean = data_import.clean_data(df)
+
+        self.assertTrue(0.85 * 2000 < len(df_clean) < 2000)
+        self.assertTrue((df_clean['kcal_ratio'] <= 1.3).all())
+        self.assertTrue(df_clean['extra_category'].str.len().gt(0).any())
+        self.assertGreater(df['category'].nunique(), 100)
+
+    def test_chunked_import_matches_whole_import(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_path = os.path.join(tmp_dir, 'resultset.csv')
+            synthetic_catalog.write_catalog(csv_path, 1000)
+            df = data_import.get_data(csv_path, chunksize=10000)
+            chunks = list(data_import.iter_data(csv_path, chunksize=300))
+
+        self.assertEqual(len(chunks), 4)
+        pd.testing.assert_frame_equal(pd.concat(chunks), df)
+
 
 if __name__ == '__main__':
     unittest.main()
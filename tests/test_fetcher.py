@@ -0,0 +1,112 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import sys
+sys.path.insert(0, '..')
+import fetcher
+from tests.test_catalog import write_test_csv
+
+
+class FineliStandIn(BaseHTTPRequestHandler):
+    """Serves server.content with an ETag, conditional requests and byte ranges, like Fineli's server"""
+
+    def do_GET(self):
+        content = self.server.content
+        etag = '"' + hashlib.md5(content).hexdigest() + '"'
+        self.server.requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        start = 0
+        if self.headers.get('Range') and self.headers.get('If-Range') == etag:
+            start = int(self.headers['Range'][len('bytes='):-1])
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(content) - 1}/{len(content)}')
+        else:
+            self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(content) - start))
+        self.end_headers()
+        self.wfile.write(content[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+class TestFetcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.csv_path = os.path.join(self.tmp_dir, 'resultset.csv')
+        self.mirror_path = os.path.join(self.tmp_dir, 'mirror', 'resultset.csv')
+        os.makedirs(os.path.dirname(self.mirror_path))
+        write_test_csv(self.mirror_path, ['Chicken Soup, Canned', 'Pork, Fillet'])
+        with open(self.mirror_path, 'rb') as f:
+            self.content = f.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def start_server(self):
+        server = HTTPServer(('127.0.0.1', 0), FineliStandIn)
+        server.content = self.content
+        server.requests = []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server, f'http://127.0.0.1:{server.server_port}/resultset.csv'
+
+    def test_conditional_and_resumed_download(self):
+        server, url = self.start_server()
+        csv_fetcher = fetcher.Fetcher(source=url, csv_path=self.csv_path)
+        state = csv_fetcher.fetch()
+        self.assertEqual(state['status'], 'downloaded')
+        self.assertEqual(state['sha256'], hashlib.sha256(self.content).hexdigest())
+        with open(self.csv_path, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+
+        self.assertEqual(csv_fetcher.fetch()['status'], 'not_modified')
+        self.assertIn('If-None-Match', server.requests[-1])
+
+        # A new version, of which the first half was downloaded before the connection broke
+        write_test_csv(self.mirror_path, ['Beef, Minced', 'Salmon, Smoked'])
+        with open(self.mirror_path, 'rb') as f:
+            server.content = f.read()
+        with open(csv_fetcher.part_path, 'wb') as f:
+            f.write(server.content[:40])
+        fetcher._save_json(f'{csv_fetcher.part_path}.json', {
+            'source': url, 'etag': '"' + hashlib.md5(server.content).hexdigest() + '"'})
+
+        state = csv_fetcher.fetch()
+        self.assertEqual(server.requests[-1]['Range'], 'bytes=40-')
+        self.assertEqual(state['status'], 'downloaded')
+        self.assertEqual(len(set(state['history'])), 2)
+        with open(self.csv_path, 'rb') as f:
+            self.assertEqual(f.read(), server.content)
+
+    def test_local_mirror_and_offline(self):
+        csv_fetcher = fetcher.Fetcher(source=self.mirror_path, csv_path=self.csv_path)
+        state = csv_fetcher.fetch()
+        self.assertEqual(state['status'], 'downloaded')
+        self.assertTrue(os.path.exists(os.path.join(csv_fetcher.snapshot_dir, f'{state["version"]}.csv')))
+        self.assertEqual(csv_fetcher.fetch()['status'], 'not_modified')
+
+        os.remove(self.mirror_path)
+        self.assertEqual(csv_fetcher.fetch()['status'], 'offline')
+        self.assertEqual(csv_fetcher.get_state()['version'], state['version'])
+
+    def test_checksum_mismatch_is_rejected(self):
+        csv_fetcher = fetcher.Fetcher(source=self.mirror_path, csv_path=self.csv_path, sha256='0' * 64)
+        with self.assertRaises(ValueError):
+            csv_fetcher.fetch()
+        self.assertFalse(os.path.exists(self.csv_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
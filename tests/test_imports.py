@@ -0,0 +1,30 @@
+import os
+import sys
+import unittest
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only the optimization, the CSV download and the analytics need these
+LAZY_MODULES = ['scipy', 'matplotlib', 'seaborn', 'pandera', 'requests', 'algorithm', 'batch']
+
+
+def get_imported_modules(code):
+    """The modules in sys.modules after running the code in a fresh interpreter"""
+    output = subprocess.run(
+        [sys.executable, '-c', f'{code}\nimport sys\nprint(" ".join(sys.modules))'],
+        cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True,
+        universal_newlines=True).stdout
+    return set(output.splitlines()[-1].split())
+
+
+class TestImports(unittest.TestCase):
+
+    def test_app_does_not_load_the_solver_or_analytics(self):
+        modules = get_imported_modules('import app')
+        self.assertIn('catalog', modules)
+        self.assertEqual([module for module in LAZY_MODULES if module in modules], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
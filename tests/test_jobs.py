@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import sys
+sys.path.insert(0, '..')
+import app
+import catalog
+import jobs
+from tests.test_algorithm import get_test_meals
+
+
+class TestJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.catalog = catalog.get_catalog
+        food_catalog = catalog.Catalog.from_dataframe(get_test_meals())
+        catalog.get_catalog = lambda *args: food_catalog
+        self.tmp_dir = tempfile.mkdtemp()
+        # The jobs run in this process, where the test catalog is patched in
+        self.job_queue = jobs.JobQueue(jobs_dir=self.tmp_dir)
+        self.job_queue.executor = ThreadPoolExecutor(max_workers=1)
+        self.job_queue.sibling_executor = ThreadPoolExecutor(max_workers=1)
+        self.job_queue.sibling_nice = 0  # Not for the test process itself
+
+    def tearDown(self):
+        catalog.get_catalog = self.catalog
+        shutil.rmtree(self.tmp_dir)
+
+    def test_sibling_variants(self):
+        job_id = self.job_queue.submit(2, 'lactose', True)
+        self.job_queue.executor.shutdown(wait=True)
+        self.job_queue.sibling_executor.shutdown(wait=True)
+        self.assertEqual(self.job_queue.pending_siblings, 0)
+
+        status = self.job_queue.get_status(job_id)
+        self.assertEqual(status['status'], 'done')
+        variants = {(variant['allergy'], variant['low_salt']) for variant in status['variants']}
+        self.assertEqual(variants, set(jobs.VARIANTS))
+        self.assertEqual(status['variants'][0]['job_id'], job_id)
+
+        sibling_id = self.job_queue.get_sibling(job_id, 2, '', True)
+        sibling = self.job_queue.get_status(sibling_id)
+        self.assertEqual((sibling['allergy'], sibling['low_salt'], sibling['status']), ('', True, 'done'))
+        meal_plans, nutrients = self.job_queue.get_nutrients_and_meal_plans(sibling_id)
+        self.assertEqual(len(meal_plans), 2)
+        self.assertIsNone(self.job_queue.get_sibling(job_id, 3, '', True))
+        self.assertIsNone(self.job_queue.get_sibling(job_id, 2, 'lactose', True))
+
+        # Toggling low salt on the job's page goes to the sibling's meal plans
+        job_queue = app.job_queue
+        app.job_queue = self.job_queue
+        try:
+            response = app.app.test_client().post('/upadate-meal-plan', data={
+                'days': '2', 'allergy': 'lactose', 'new_meal_plan': '1', 'job_id': job_id})
+        finally:
+            app.job_queue = job_queue
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(self.job_queue.get_sibling(job_id, 2, 'lactose', False), response.headers['Location'])
+
+    def test_siblings_are_skipped_when_backed_up(self):
+        self.job_queue.pending_siblings = jobs.MAX_PENDING_SIBLINGS
+        job_id = self.job_queue.submit(1, '', False)
+        self.job_queue.executor.shutdown(wait=True)
+        self.assertEqual([variant['job_id'] for variant in self.job_queue.get_status(job_id)['variants']], [job_id])
+        self.assertEqual(os.listdir(self.tmp_dir), [job_id])
+
+    def test_finished_jobs_are_pruned(self):
+        job_ids = {}
+        for status in ['done', 'failed', 'running']:
+            job_ids[status] = uuid.uuid4().hex
+            job_dir = jobs.get_job_dir(job_ids[status], self.tmp_dir)
+            os.makedirs(job_dir)
+            jobs.write_status(job_dir, status, {'days': 1})
+
+        self.job_queue.prune()
+        self.assertEqual(len(os.listdir(self.tmp_dir)), 3)
+        self.job_queue.retention = -1
+        self.job_queue.prune()
+        self.assertEqual(os.listdir(self.tmp_dir), [job_ids['running']])
+
+    def test_invalid_job_requests(self):
+        job_queue = app.job_queue
+        app.job_queue = self.job_queue
+        try:
+            client = app.app.test_client()
+            for days in ['x', '0', str(app.API_MAX_DAYS + 1)]:
+                self.assertEqual(client.post('/meal-plan-jobs', data={'days': days}).status_code, 400, days)
+        finally:
+            app.job_queue = job_queue
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import json
+import unittest
+
+import sys
+sys.path.insert(0, '..')
+import metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_timer_records_stage(self):
+        stage_metrics = metrics.Metrics()
+        with stage_metrics.timer('post_processing') as stage:
+            stage['rows'] = 12
+        with stage_metrics.timer('post_processing', rows=3):
+            pass
+
+        totals = stage_metrics.get_stats()['stages']['post_processing']
+        self.assertEqual(totals['count'], 2)
+        self.assertEqual(totals['rows'], 15)
+        self.assertGreaterEqual(totals['seconds'], totals['max_seconds'])
+
+    def test_timer_records_failed_stage(self):
+        stage_metrics = metrics.Metrics()
+        with self.assertLogs('meal_planner.metrics', level='INFO') as logs:
+            with self.assertRaises(ValueError):
+                with stage_metrics.timer('lp_solve', rows=5):
+                    raise ValueError('infeasible')
+
+        stats = stage_metrics.get_stats()
+        self.assertEqual(stats['stages']['lp_solve']['count'], 1)
+        self.assertEqual(stats['stages']['lp_solve']['rows'], 5)
+        self.assertEqual(stats['counters'], [['stage_errors_total', {'stage': 'lp_solve', 'error': 'ValueError'}, 1]])
+        self.assertEqual(json.loads(logs.records[0].getMessage())['error'], 'ValueError')
+
+    def test_merge_and_render_prometheus(self):
+        stage_metrics = metrics.Metrics()
+        stage_metrics.record('lp_solve', 0.5, rows=100, status=0)
+        stage_metrics.increment('lp_solves_total', status=0)
+
+        job_metrics = metrics.Metrics()
+        job_metrics.record('lp_solve', 1.5, rows=100, status=0)
+        job_metrics.increment('lp_solves_total', status=0)
+        job_metrics.increment('lp_solves_total', status=2)
+        stage_metrics.merge(job_metrics.get_stats())
+
+        text = metrics.render_prometheus(stage_metrics.get_stats(), {
+            'size': 1, 'max_size': 256, 'hits': 3, 'disk_hits': 0, 'misses': 1, 'evictions': 0})
+        lines = text.splitlines()
+        self.assertIn('meal_planner_stage_seconds_count{stage="lp_solve"} 2', lines)
+        self.assertIn('meal_planner_stage_seconds_sum{stage="lp_solve"} 2.000000', lines)
+        self.assertIn('meal_planner_stage_max_seconds{stage="lp_solve"} 1.500000', lines)
+        self.assertIn('meal_planner_lp_solves_total{status="0"} 2', lines)
+        self.assertIn('meal_planner_lp_solves_total{status="2"} 1', lines)
+        self.assertIn('meal_planner_plan_cache_hits_total 3', lines)
+        self.assertEqual(lines.count('# TYPE meal_planner_lp_solves_total counter'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
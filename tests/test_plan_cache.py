@@ -0,0 +1,44 @@
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+import sys
+sys.path.insert(0, '..')
+import plan_cache
+
+
+class TestPlanCache(unittest.TestCase):
+
+    def test_get_plan_key(self):
+        key = plan_cache.get_plan_key('model', np.array([13.0, -25.0]), None)
+        self.assertEqual(key, plan_cache.get_plan_key('model', np.array([13.0, -25.0]), None))
+        self.assertNotEqual(key, plan_cache.get_plan_key('model', np.array([13.0, -20.0]), None))
+        self.assertNotEqual(key, plan_cache.get_plan_key('model', np.array([13.0, -25.0]), 'highs'))
+
+    def test_lru_eviction(self):
+        cache = plan_cache.PlanCache(max_size=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)  # 'b' is now the least recently used
+        cache.put('c', 3)
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.get_stats(), {
+            'size': 2, 'max_size': 2, 'hits': 2, 'disk_hits': 0, 'misses': 1, 'evictions': 1})
+
+    def test_disk_tier(self):
+        directory = tempfile.mkdtemp()
+        try:
+            plan_cache.PlanCache(max_size=1, directory=directory).put('a', np.arange(3))
+
+            cache = plan_cache.PlanCache(max_size=1, directory=directory)
+            self.assertEqual(cache.get('a').tolist(), [0, 1, 2])
+            self.assertEqual(cache.get_stats()['disk_hits'], 1)
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import sys
+sys.path.insert(0, '..')
+import catalog
+import plan_library
+from tests import synthetic_catalog
+
+
+class TestPlanLibrary(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.csv_path = os.path.join(self.tmp_dir, 'resultset.csv')
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        synthetic_catalog.write_catalog(self.csv_path, 3000)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_nearest_profile_is_rescaled(self):
+        library = plan_library.PlanLibrary.build(
+            days=2, workers=2, csv_path=self.csv_path, cache_dir=self.cache_dir,
+            kcal_limits=[2000, 2500], splits=[(0.5, 0.3, 0.2)], allergy_sets=[(), ('lactose',)])
+        path = os.path.join(self.tmp_dir, 'library.npz')
+        library.save(path)
+        library = plan_library.PlanLibrary.load(path)
+        food_catalog = catalog.load_catalog(self.csv_path, self.cache_dir)
+        self.assertEqual(len(library), 8)
+
+        limits = {'kcal_limit': 2150, 'allergies': ['lactose'], 'low_salt': False}
+        self.assertEqual(library.lookup(limits)[0][1], 2150 / 2000)
+        days = library.get_daily_meal_plans(food_catalog, limits, 2)
+        self.assertEqual(len(days), 2)
+        for day in days:
+            total = day.get_total_nutrients()
+            self.assertAlmostEqual(total['kcal'], 2150, delta=2150 * 0.03)
+            self.assertEqual(total['lactose'], 0)
+
+        # A split near the precomputed one is served with the precomputed split, and says so
+        limits = dict(limits, carb_kcal_limit=2150 * 0.51, protein_kcal_limit=2150 * 0.29,
+                      fat_kcal_limit=2150 * 0.2)
+        days = library.get_daily_meal_plans(food_catalog, limits, 2)
+        self.assertAlmostEqual(days[0].limits['carb_kcal_limit'], 2150 * 0.5)
+        self.assertAlmostEqual(days[0].limits['protein_kcal_limit'], 2150 * 0.3)
+        self.assertAlmostEqual(days[0].get_total_nutrients()['carb_kcal'], 2150 * 0.5, delta=2150 * 0.01)
+
+        # Outside the grid
+        self.assertEqual(library.lookup({'kcal_limit': 4000, 'allergies': []}), [])
+        self.assertEqual(library.lookup({'kcal_limit': 2000, 'allergies': ['nuts']}), [])
+        self.assertEqual(library.lookup({'kcal_limit': 2000, 'carb_kcal_limit': 800, 'allergies': []}), [])
+        self.assertEqual(library.lookup({'kcal_limit': 2000, 'fibre_limit': 40, 'allergies': []}), [])
+        self.assertIsNone(library.get_daily_meal_plans(food_catalog, limits, 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import sys
+sys.path.insert(0, '..')
+import plan_store
+
+PRE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'daily_meal_plans', 'pre')
+
+
+class TestPlanStore(unittest.TestCase):
+
+    def setUp(self):
+        self.plans_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.plans_dir, 'new'))
+        for fname in ['0_pre_meal_plan.csv', '0_pre_nutrients.csv', '1_pre_meal_plan.csv',
+                      '1_pre_nutrients.csv', '2_pre_meal_plan.csv', '2_pre_nutrients.csv']:
+            shutil.copy(os.path.join(PRE_DIR, fname),
+                        os.path.join(self.plans_dir, 'new', fname.replace('_pre', '')))
+        self.store = plan_store.PlanStore(self.plans_dir, check_interval=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.plans_dir)
+
+    def test_get_nutrients_and_meal_plans(self):
+        meal_plans, nutrients = self.store.get_nutrients_and_meal_plans(2, new_meal_plan=True)
+
+        self.assertEqual(len(meal_plans), 2)
+        self.assertEqual(len(nutrients), 2)
+        self.assertEqual(meal_plans[0]['name'][-1], 'Total')
+        self.assertAlmostEqual(meal_plans[0]['kcal'][-1], nutrients[0]['kcal'][0], delta=0.1)
+        self.assertAlmostEqual(meal_plans[0]['salt'][-1], nutrients[0]['salt'][0] / 1000, delta=0.1)
+
+    def test_reload_when_directory_changes(self):
+        meal_plans, _ = self.store.get_nutrients_and_meal_plans(7, new_meal_plan=True)
+        self.assertEqual(len(meal_plans), 3)
+
+        os.remove(os.path.join(self.plans_dir, 'new', '2_meal_plan.csv'))
+        meal_plans, _ = self.store.get_nutrients_and_meal_plans(7, new_meal_plan=True)
+        self.assertEqual(len(meal_plans), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+import sys
+import numpy as np
+sys.path.insert(0, '..')
+import variety
+
+
+class TestVarietyTracker(unittest.TestCase):
+
+    def test_record_and_readmit(self):
+        tracker = variety.VarietyTracker(100, seed=0, readmit_share=0.5, cooldown=1)
+        tracker.record(np.arange(10))
+        # Yesterday's foods are in cooldown, none can be re-admitted yet
+        self.assertEqual(tracker.readmitted, 0)
+        self.assertEqual(tracker.excluded.sum(), 10)
+
+        tracker.record(np.arange(10, 14))
+        self.assertEqual(tracker.readmitted, 7)  # Half of the 14 excluded foods
+        self.assertTrue(tracker.excluded[10:14].all())
+        self.assertEqual(tracker.excluded[:10].sum(), 3)
+        self.assertEqual(tracker.uses.sum(), 14)
+        self.assertEqual(tracker.day, 2)
+
+    def test_least_used_foods_are_readmitted_first(self):
+        for seed in range(5):
+            tracker = variety.VarietyTracker(10, seed=seed, readmit_share=0.5, cooldown=1)
+            for rows in [np.arange(6), np.arange(2), np.arange(2), [8]]:
+                tracker.uses[rows] += 1
+                tracker.last_day[rows] = tracker.day
+                tracker.excluded[rows] = True
+                tracker.day += 1
+            tracker.readmit()
+            # Foods 2-5 were eaten once, 0 and 1 three times, 8 is in cooldown
+            self.assertEqual(tracker.readmitted, 4)
+            np.testing.assert_array_equal(np.nonzero(tracker.excluded)[0], [0, 1, 8])
+
+    def test_same_seed_same_readmissions(self):
+        def excluded(seed):
+            tracker = variety.VarietyTracker(50, seed=seed, cooldown=0)
+            for day in range(5):
+                tracker.record(np.arange(day * 10, day * 10 + 10))
+            return tracker.excluded
+
+        np.testing.assert_array_equal(excluded(3), excluded(3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import numpy as np
+
+READMIT_SHARE = 0.2  # Share of the used foods that are allowed back every day
+COOLDOWN_DAYS = 1  # Days a used food is excluded for sure
+
+
+class VarietyTracker():
+    """
+    Which foods of the catalog were eaten on the previous days, so that a multi-day
+    meal plan does not repeat the same foods.
+
+    The usage is kept in arrays over the catalog rows, so recording a day and
+    re-admitting foods costs the same on the 30th day as on the first one.
+    After each day READMIT_SHARE of the excluded foods are re-admitted, except the
+    ones used within the last COOLDOWN_DAYS days. The foods eaten on the fewest days
+    are re-admitted first, so the plans rotate through the catalog; ties are broken
+    at random. The random draws come from the tracker's own seeded generator, so the
+    same seed gives the same plans.
+    """
+
+    def __init__(self, n_foods, seed=None, readmit_share=READMIT_SHARE, cooldown=COOLDOWN_DAYS):
+        self.seed = seed
+        self.readmit_share = readmit_share
+        self.cooldown = cooldown
+        self.random = np.random.RandomState(seed)
+        self.day = 0  # The day being planned
+        self.uses = np.zeros(n_foods, dtype=np.int32)  # Days every food has been eaten on
+        self.last_day = np.full(n_foods, -1, dtype=np.int32)
+        self.excluded = np.zeros(n_foods, dtype=bool)
+        self.readmitted = 0  # Foods re-admitted for the day being planned
+
+    def record(self, rows):
+        """Marks the foods (catalog rows) of the day's meal plan as used and moves on to the next day"""
+        self.uses[rows] += 1
+        self.last_day[rows] = self.day
+        self.excluded[rows] = True
+        self.day += 1
+        self.readmit()
+
+    def readmit(self):
+        readmit_n = int(round(self.excluded.sum() * self.readmit_share))
+        candidates = np.nonzero(self.excluded & (self.last_day < self.day - self.cooldown))[0]
+        readmit_n = min(readmit_n, len(candidates))
+        if readmit_n:
+            # The least used first, in random order among the equally used
+            order = np.lexsort((self.random.rand(len(candidates)), self.uses[candidates]))
+            self.excluded[candidates[order[:readmit_n]]] = False
+        self.readmitted = readmit_n